@@ -1,18 +1,74 @@
+import asyncio
 import logging
+import math
 import os
 import secrets
 import sys
+from contextlib import asynccontextmanager
+from typing import Optional
 from urllib.parse import urlencode
 
-import httpx
 from dotenv import load_dotenv
-from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    ORJSONResponse,
+    RedirectResponse,
+)
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
-from app.services.frontend import get_dashboard_page, get_login_page
-from app.services.spotify import get_top_artists, get_top_tracks
-from app.services.storage import StorageService
+from app.services.cache import TTLCache
+from app.services.catalog import get_catalog_store, split_snapshot
+from app.services.events import USER_UPDATED, EventBus
+from app.services.feature_store import FEATURE_STORE_COMPACT_INTERVAL, FeatureStore
+from app.services.frontend import (
+    ASSET_CACHE_CONTROL,
+    DASHBOARD_CACHE_CONTROL,
+    DASHBOARD_PAGE,
+    LOGIN_PAGE,
+    PAGE_CACHE_CONTROL,
+    STATIC_ASSETS,
+)
+from app.services.ingest_queue import IngestQueue
+from app.services.lsh import LSHIndex, load_index, save_index
+from app.services.matching import (
+    MATCH_CACHE_K,
+    MATCH_SYNC_INTERVAL,
+    MatchCache,
+    MatchIndex,
+    load_from_storage,
+    user_features,
+)
+from app.services.precompute import (
+    PRECOMPUTE_INTERVAL,
+    MatchLists,
+    precompute_matches,
+)
+from app.services.projection import (
+    compact_artist,
+    compact_playlist,
+    compact_track,
+    project_page,
+)
+from app.services.ratelimit import Priority
+from app.services.sessions import create_session_store
+from app.services.spotify import (
+    LIBRARY_COLLECTIONS,
+    SPOTIFY_PAGE_CONCURRENCY,
+    CatalogEnricher,
+    SpotifyRateLimitError,
+    close_client,
+    exchange_code,
+    get_current_user,
+    get_playlists,
+    get_top_artists,
+    get_top_tracks,
+    init_client,
+    iter_library,
+)
+from app.services.storage import close_storage_service, get_storage_service
+from app.services.tokens import TokenError, TokenManager, TokenRefreshUnavailable
 
 load_dotenv()
 
@@ -32,11 +88,137 @@ SCOPES = [
     "user-follow-read",
 ]
 
-# Store tokens in memory (use database in production)
-# Maps session_token -> {user_id, access_token}
-sessions = {}
+# Time ranges ingested for top artists and tracks
+TIME_RANGES = ["short_term", "medium_term", "long_term"]
+
+# Maps session_token -> {user_id}; backend chosen by SESSION_BACKEND
+SESSION_TTL = 30 * 24 * 60 * 60  # 30 days
+sessions = create_session_store()
+
+# Maps user_id -> {access_token, refresh_token, expires_at}; ingest jobs only
+# carry a user_id, so tokens must outlive the process like the queue does and be
+# visible to every worker draining it. TOKEN_DB_PATH holds refresh tokens in
+# plain text: keep it on a private volume, readable by the app user only.
+# Opened in the app lifespan
+TOKEN_BACKEND = os.getenv("TOKEN_BACKEND", "sqlite")
+TOKEN_DB_PATH = os.getenv("TOKEN_DB_PATH", "tokens.db")
+token_manager: TokenManager | None = None
+
+# Per-user cache of Spotify responses for the /api/data/* endpoints
+# Keys are (user_id, endpoint, time_range, limit)
+response_cache = TTLCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_MAXSIZE", "10000")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "600")),
+)
+
+# Durable queue feeding ingest_user_data, opened in the app lifespan
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH", "ingest_queue.db")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+ingest_queue: IngestQueue | None = None
+
+# Taste vectors of every ingested user, memory-mapped from FEATURE_STORE_DIR;
+# opened in the app lifespan
+match_index: MatchIndex | None = None
+
+# Candidate index so a match query scores a few users instead of everyone;
+# replaced by the saved index, if any, in the lifespan
+lsh_index = LSHIndex()
 
-app = FastAPI()
+# Users' top matches, patched as other users change; built in the lifespan
+match_cache: MatchCache | None = None
+
+# Domain events, e.g. USER_UPDATED once an ingest has stored new snapshots
+events = EventBus()
+
+# Fetches catalog metadata missing from top lists, batched across ingests
+catalog_enricher = CatalogEnricher(CLIENT_ID, CLIENT_SECRET)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared resources on startup and release them on shutdown"""
+    global ingest_queue, lsh_index, match_index, match_cache, token_manager
+    init_client()
+    token_store = await asyncio.to_thread(
+        create_session_store, TOKEN_BACKEND, "tokens", TOKEN_DB_PATH
+    )
+    token_manager = TokenManager(token_store, CLIENT_ID, CLIENT_SECRET, ttl=SESSION_TTL)
+    storage_service = None
+    try:
+        # Discover credentials and open the GCS session once, up front
+        storage_service = await asyncio.to_thread(get_storage_service)
+    except Exception as e:
+        logger.warning(f"Storage service unavailable at startup: {e}")
+
+    # Opening the store may repair or compact it, so it happens off the loop
+    match_index = MatchIndex(await asyncio.to_thread(FeatureStore))
+    match_cache = MatchCache(match_index, lsh_index)
+    compact_task = asyncio.create_task(_compact_periodically())
+
+    rebuild = len(match_index) == 0 and storage_service is not None
+    saved_lsh_index = await asyncio.to_thread(load_index, storage_service)
+    if saved_lsh_index is not None:
+        if rebuild:
+            # Every row the rebuild writes is new, whatever the cursor says
+            saved_lsh_index.cursor = None
+        # Users stored after it was saved are added by the first sync
+        lsh_index = saved_lsh_index
+        match_cache.use_lsh(lsh_index)
+
+    if rebuild:
+        # Empty feature store: load taste vectors from the bucket in the
+        # background; matching fills in as it goes
+        match_loader = asyncio.create_task(
+            asyncio.to_thread(
+                load_from_storage,
+                storage_service,
+                [match_index],
+                catalog=get_catalog_store(),
+            )
+        )
+        match_loader.add_done_callback(_log_match_loader_failure)
+    else:
+        match_loader = None
+    # Fills the LSH index from the store, then follows other processes' updates
+    match_sync_task = asyncio.create_task(_sync_matches_periodically(match_loader))
+
+    lists = await asyncio.to_thread(MatchLists.load)
+    if lists is not None:
+        match_cache.use_lists(lists)
+    precompute_task = None
+    if PRECOMPUTE_INTERVAL > 0:
+        precompute_task = asyncio.create_task(_precompute_periodically())
+
+    ingest_queue = IngestQueue(
+        INGEST_QUEUE_PATH,
+        ingest_user_data,
+        workers=INGEST_WORKERS,
+        max_attempts=INGEST_MAX_ATTEMPTS,
+        # Missing or revoked tokens need the user to log in again
+        permanent_errors=(TokenError,),
+    )
+    await ingest_queue.start()
+    try:
+        yield
+    finally:
+        await ingest_queue.stop()
+        if match_loader is not None:
+            match_loader.cancel()
+        match_sync_task.cancel()
+        compact_task.cancel()
+        if precompute_task is not None:
+            precompute_task.cancel()
+        try:
+            await asyncio.to_thread(save_index, lsh_index, storage_service)
+        except Exception as e:
+            logger.warning(f"Failed to save the LSH index: {e}")
+        match_index.store.close()
+        await close_client()
+        await asyncio.to_thread(close_storage_service)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(ProxyHeadersMiddleware)
 
 # Create the logger
@@ -48,18 +230,113 @@ logger = logging.getLogger(__name__)
 # ==================== HELPER FUNCTIONS ====================
 
 
-def get_user_id_from_session(request: Request) -> tuple[str, str]:
-    """Extract user_id and access_token from session cookie"""
+def _log_match_loader_failure(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Failed to load the match index: {task.exception()}")
+
+
+async def _sync_matches_periodically(
+    match_loader: Optional[asyncio.Task] = None,
+) -> None:
+    """
+    Apply users other processes stored in the feature store, each
+    MATCH_SYNC_INTERVAL seconds
+
+    USER_UPDATED only reaches the process whose ingest published it; this
+    keeps the LSH index and cached lists of every process current.
+    """
+    if match_loader is not None:
+        await asyncio.wait([match_loader])
+    while True:
+        try:
+            synced = await asyncio.to_thread(match_cache.sync)
+            if synced:
+                logger.debug(f"Synced {synced} users from the feature store")
+        except Exception as e:
+            logger.warning(f"Failed to sync the match index: {e}")
+        await asyncio.sleep(MATCH_SYNC_INTERVAL)
+
+
+async def _compact_periodically() -> None:
+    """Compact the feature store each FEATURE_STORE_COMPACT_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(FEATURE_STORE_COMPACT_INTERVAL)
+        try:
+            # Other processes pick up the new generation on their next sync
+            await asyncio.to_thread(match_index.store.compact)
+        except Exception as e:
+            logger.warning(f"Failed to compact the feature store: {e}")
+
+
+async def _precompute_periodically() -> None:
+    """Recompute every user's match lists each PRECOMPUTE_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(PRECOMPUTE_INTERVAL)
+        try:
+            await asyncio.to_thread(precompute_matches)
+        except Exception as e:
+            # e.g. another app process is already running it
+            logger.warning(f"Skipped match precompute: {e}")
+        # Pick up this run's lists, or those another process wrote
+        lists = await asyncio.to_thread(MatchLists.load)
+        current = match_cache.lists
+        if lists is not None and (
+            current is None or lists.generated_at != current.generated_at
+        ):
+            match_cache.use_lists(lists)
+
+
+def rate_limited(e: SpotifyRateLimitError) -> HTTPException:
+    """Translate a Spotify rate limit into a 429 for the client"""
+    return HTTPException(
+        status_code=429,
+        detail=str(e),
+        headers={"Retry-After": str(math.ceil(e.retry_after))},
+    )
+
+
+def snapshot_blob_name(user_id: str, kind: str, time_range: str) -> str:
+    """
+    Blob name for a user's top artists/tracks snapshot
+
+    medium_term keeps the original '{user_id}/artists.json' name so existing
+    readers continue to work; other ranges get a suffix.
+    """
+    if time_range == "medium_term":
+        return f"{user_id}/{kind}.json"
+    return f"{user_id}/{kind}_{time_range}.json"
+
+
+async def get_user_id_from_session(request: Request) -> str:
+    """Extract user_id from session cookie"""
     session_token = request.cookies.get("session")
     logger.debug(f"Checking session: token={session_token}")
-    if not session_token or session_token not in sessions:
+    session_data = (
+        await asyncio.to_thread(sessions.get, session_token) if session_token else None
+    )
+    if session_data is None:
         logger.debug("Session not found")
         raise HTTPException(status_code=401, detail="Not authenticated")
-    session_data = sessions[session_token]
     user_id = session_data["user_id"]
-    access_token = session_data["access_token"]
     logger.debug(f"Found user_id: {user_id}")
-    return user_id, access_token
+    return user_id
+
+
+async def get_access_token(user_id: str) -> str:
+    """
+    Return a fresh access token for user_id
+
+    Raises 401 if the user must log in again, and 503 if Spotify's token
+    endpoint could not be reached.
+    """
+    try:
+        return await token_manager.get_access_token(user_id)
+    except TokenError as e:
+        logger.debug(str(e))
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    except TokenRefreshUnavailable as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail="Spotify is unavailable")
 
 
 # ==================== AUTHENTICATION ROUTES ====================
@@ -81,57 +358,45 @@ async def authorize():
 # 2. SIMPLIFY THE CALLBACK (Remove the HTML/JS Middleman)
 # This replaces BOTH your @app.get('/callback') and @app.post('/api/auth/callback')
 @app.get("/callback")
-async def callback(code: str, background_tasks: BackgroundTasks):
+async def callback(code: str):
     """
     Direct Server-Side Callback.
     No HTML/JS middleman means no 'fetch' errors and no CORS issues.
     """
     try:
-        async with httpx.AsyncClient() as client:
-            # Exchange Code for Token using REAL Spotify URL
-            response = await client.post(
-                "https://accounts.spotify.com/api/token",
-                data={
-                    "grant_type": "authorization_code",
-                    "code": code,
-                    "redirect_uri": REDIRECT_URI,
-                    "client_id": CLIENT_ID,
-                    "client_secret": CLIENT_SECRET,
-                },
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-            )
-            response.raise_for_status()
-            token_data = response.json()
-            access_token = token_data["access_token"]
-
-            # Get User Profile
-            user_response = await client.get(
-                "https://api.spotify.com/v1/me",
-                headers={"Authorization": f"Bearer {access_token}"},
-            )
-            user_data = user_response.json()
-            user_id = user_data.get("id")
-
-            # Background Task
-            background_tasks.add_task(ingest_user_data, user_id, access_token)
-
-            # Create session token with both user_id and access_token
-            session_token = secrets.token_urlsafe(32)
-            sessions[session_token] = {"user_id": user_id, "access_token": access_token}
-            logger.debug(f"Session created for user {user_id}: {session_token}")
-
-            # Redirect with session cookie
-            response = RedirectResponse(url="/dashboard")
-            response.set_cookie(
-                key="session",
-                value=session_token,
-                httponly=True,
-                secure=False,  # Allow HTTP for development/proxy scenarios
-                samesite="lax",
-                max_age=30 * 24 * 60 * 60,  # 30 days
-            )
-            logger.debug("Cookie set")
-            return response
+        # Exchange Code for Token using REAL Spotify URL
+        token_data = await exchange_code(code, REDIRECT_URI, CLIENT_ID, CLIENT_SECRET)
+        access_token = token_data["access_token"]
+
+        # Get User Profile
+        user_data = await get_current_user(access_token)
+        user_id = user_data.get("id")
+
+        # Keep access and refresh tokens so later calls can renew them
+        await asyncio.to_thread(token_manager.save, user_id, token_data)
+
+        # Queue the ingest; a worker picks it up in the background
+        await ingest_queue.enqueue(user_id)
+
+        # Create session token pointing at the user
+        session_token = secrets.token_urlsafe(32)
+        await asyncio.to_thread(
+            sessions.set, session_token, {"user_id": user_id}, ttl=SESSION_TTL
+        )
+        logger.debug(f"Session created for user {user_id}: {session_token}")
+
+        # Redirect with session cookie
+        response = RedirectResponse(url="/dashboard")
+        response.set_cookie(
+            key="session",
+            value=session_token,
+            httponly=True,
+            secure=False,  # Allow HTTP for development/proxy scenarios
+            samesite="lax",
+            max_age=SESSION_TTL,
+        )
+        logger.debug("Cookie set")
+        return response
 
     except Exception as e:
         # This will show up in Cloud Run logs
@@ -144,50 +409,124 @@ async def callback(code: str, background_tasks: BackgroundTasks):
 
 @app.get("/api/data/top-artists")
 async def top_artists_endpoint(
-    request: Request, time_range: str = "medium_term", limit: int = 50
+    request: Request,
+    time_range: str = "medium_term",
+    limit: int = 50,
+    fields: Optional[str] = None,
 ):
-    """Get user's top artists"""
-    user_id, token = get_user_id_from_session(request)
-    try:
-        data = await get_top_artists(token, time_range, limit)
-        return data
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    """
+    Get user's top artists
+
+    Items use a compact shape by default; pass fields=* for Spotify's raw
+    objects or a comma-separated field list (e.g. fields=name,images.url).
+    """
+    user_id = await get_user_id_from_session(request)
+    cache_key = (user_id, "top-artists", time_range, limit)
+    data = response_cache.get(cache_key)
+    if data is None:
+        token = await get_access_token(user_id)
+        try:
+            data = await get_top_artists(token, time_range, limit)
+        except SpotifyRateLimitError as e:
+            raise rate_limited(e)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        response_cache.set(cache_key, data)
+    return project_page(data, compact_artist, fields)
 
 
 @app.get("/api/data/top-tracks")
 async def top_tracks_endpoint(
-    request: Request, time_range: str = "medium_term", limit: int = 50
+    request: Request,
+    time_range: str = "medium_term",
+    limit: int = 50,
+    fields: Optional[str] = None,
 ):
-    """Get user's top tracks"""
-    user_id, token = get_user_id_from_session(request)
-    try:
-        data = await get_top_tracks(token, time_range, limit)
-        return data
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    """
+    Get user's top tracks
+
+    Items use a compact shape by default; pass fields=* for Spotify's raw
+    objects or a comma-separated field list (e.g. fields=name,images.url).
+    """
+    user_id = await get_user_id_from_session(request)
+    cache_key = (user_id, "top-tracks", time_range, limit)
+    data = response_cache.get(cache_key)
+    if data is None:
+        token = await get_access_token(user_id)
+        try:
+            data = await get_top_tracks(token, time_range, limit)
+        except SpotifyRateLimitError as e:
+            raise rate_limited(e)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        response_cache.set(cache_key, data)
+    return project_page(data, compact_track, fields)
 
 
 @app.get("/api/data/playlists")
-async def playlists_endpoint(request: Request, limit: int = 50):
-    """Get user's playlists"""
-    user_id, token = get_user_id_from_session(request)
-    try:
-        from app.services.spotify import get_playlists
+async def playlists_endpoint(
+    request: Request, limit: int = 50, fields: Optional[str] = None
+):
+    """
+    Get user's playlists
 
-        data = await get_playlists(token, limit)
-        return data
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    Items use a compact shape by default; pass fields=* for Spotify's raw
+    objects or a comma-separated field list (e.g. fields=name,images.url).
+    """
+    user_id = await get_user_id_from_session(request)
+    cache_key = (user_id, "playlists", None, limit)
+    data = response_cache.get(cache_key)
+    if data is None:
+        token = await get_access_token(user_id)
+        try:
+            data = await get_playlists(token, limit)
+        except SpotifyRateLimitError as e:
+            raise rate_limited(e)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        response_cache.set(cache_key, data)
+    return project_page(data, compact_playlist, fields)
+
+
+# ==================== MATCHING ROUTES ====================
+
+
+@app.get("/api/match/top")
+async def top_matches_endpoint(request: Request, k: int = 10, exact: bool = False):
+    """
+    Get the k users whose music taste is most compatible with the user's
+
+    Lists are cached and kept up to date as other users are ingested. Only
+    users sharing an LSH bucket with the user are scored unless exact=true,
+    which also bypasses the cache.
+    """
+    user_id = await get_user_id_from_session(request)
+    k = max(1, min(k, MATCH_CACHE_K))
+    try:
+        if exact:
+            matches = await asyncio.to_thread(match_cache.compute, user_id, k, True)
+        else:
+            matches = await asyncio.to_thread(match_cache.get, user_id, k)
+    except KeyError:
+        raise HTTPException(
+            status_code=404, detail="No taste profile yet; try again after ingest"
+        )
+    return {
+        "matches": [
+            {"user_id": match_id, "score": round(score, 4)}
+            for match_id, score in matches
+        ],
+        "total": len(match_index),
+    }
 
 
 # ==================== FRONTEND ROUTES ====================
 
 
 @app.get("/", response_class=HTMLResponse)
-async def root():
+async def root(request: Request):
     """Serve login page"""
-    return get_login_page()
+    return LOGIN_PAGE.response(request, PAGE_CACHE_CONTROL)
 
 
 @app.get("/dashboard", response_class=HTMLResponse)
@@ -195,25 +534,40 @@ async def dashboard(request: Request):
     """Serve authenticated dashboard page"""
     # Check if user is authenticated
     try:
-        get_user_id_from_session(request)
+        await get_user_id_from_session(request)
     except HTTPException:
         # If not authenticated, redirect to login
         return RedirectResponse(url="/")
-    return get_dashboard_page()
+    return DASHBOARD_PAGE.response(request, DASHBOARD_CACHE_CONTROL)
+
+
+@app.get("/static/{name}")
+async def static_asset(name: str, request: Request):
+    """Serve fingerprinted CSS/JS assets"""
+    asset = STATIC_ASSETS.get(name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return asset.response(request, ASSET_CACHE_CONTROL)
 
 
 @app.post("/api/auth/logout")
 async def logout(request: Request):
     """Logout user and clear session"""
     session_token = request.cookies.get("session")
-    if session_token and session_token in sessions:
-        del sessions[session_token]
+    if session_token:
+        await asyncio.to_thread(sessions.delete, session_token)
     response = {"status": "logged out"}
     response_obj = JSONResponse(response)
     response_obj.delete_cookie("session")
     return response_obj
 
 
+@app.get("/api/ingest/status")
+async def ingest_status():
+    """Report how many ingest jobs are pending"""
+    return {"queue_depth": await asyncio.to_thread(ingest_queue.depth)}
+
+
 @app.get("/debug-vars")
 def debug_vars():
     return {
@@ -226,29 +580,140 @@ def debug_vars():
 # ==================== BACKGROUND TASKS ====================
 
 
-async def ingest_user_data(user_id: str, access_token: str) -> None:
+async def ingest_user_data(user_id: str) -> None:
     """
-    Background task to fetch and upload user data to GCS
+    Ingest job handler: fetch user data and upload it to GCS
+
+    Top artists and tracks for every time range, plus the user's full library
+    (saved tracks and albums, followed artists and playlist items), are fetched
+    concurrently. Library pages share one semaphore so a single heavy user
+    cannot monopolise the Spotify quota, and are streamed straight into
+    '{user_id}/{collection}.ndjson' blobs so memory stays flat however large the
+    library is. The blocking GCS uploads run in worker threads so they never
+    stall the event loop. Matching and catalog enrichment are updated as soon
+    as the top lists are stored, before the library finishes. Errors propagate
+    so the ingest queue can retry the job.
 
     Args:
         user_id: Spotify user ID
-        access_token: Spotify access token
     """
+    access_token = await token_manager.get_access_token(user_id)
+    fetchers = {"artists": get_top_artists, "tracks": get_top_tracks}
+    snapshots = [(kind, time_range) for kind in fetchers for time_range in TIME_RANGES]
+    page_semaphore = asyncio.Semaphore(SPOTIFY_PAGE_CONCURRENCY)
+
+    # Shared storage service; created off the event loop if startup skipped it
+    storage_service = await asyncio.to_thread(get_storage_service)
+
+    # Stream every library collection to GCS while the top lists are fetched
+    library = asyncio.gather(
+        *(
+            storage_service.stream_ndjson(
+                iter_library(collection, access_token, page_semaphore),
+                f"{user_id}/{collection}.ndjson",
+            )
+            for collection in LIBRARY_COLLECTIONS
+        )
+    )
+
+    # Fetch top artists and tracks for all time ranges in parallel
     try:
-        # Initialize storage service
-        storage_service = StorageService()
+        results = await asyncio.gather(
+            *(
+                fetchers[kind](
+                    access_token, time_range, 50, priority=Priority.BACKGROUND
+                )
+                for kind, time_range in snapshots
+            )
+        )
+    except BaseException:
+        library.cancel()
+        raise
+
+    # Replace any cached responses with the freshly ingested data
+    response_cache.invalidate_user(user_id)
+    for (kind, time_range), data in zip(snapshots, results):
+        response_cache.set((user_id, f"top-{kind}", time_range, 50), data)
+
+    # Upload to GCS: artist and track objects go to the shared catalog once,
+    # before the user's ranked ID lists that refer to them
+    catalog = await asyncio.to_thread(get_catalog_store)
+    ranked_lists = []
+    catalog_items = {kind: [] for kind in fetchers}
+    for (kind, _), data in zip(snapshots, results):
+        ranked, items = split_snapshot(kind, data)
+        ranked_lists.append(ranked)
+        catalog_items[kind].extend(items)
+    try:
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(catalog.put, kind, items)
+                for kind, items in catalog_items.items()
+            )
+        )
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    storage_service.upload_json,
+                    ranked,
+                    snapshot_blob_name(user_id, kind, time_range),
+                )
+                for (kind, time_range), ranked in zip(snapshots, ranked_lists)
+            ),
+            enrich_catalog(user_id, catalog, catalog_items["tracks"]),
+        )
+    except BaseException:
+        library.cancel()
+        raise
+
+    # Let matching pick up the user's new taste vector; it only depends on the
+    # top lists, so a failing library collection does not hold it back
+    await events.publish(
+        USER_UPDATED,
+        {"user_id": user_id, "features": user_features(zip(snapshots, results))},
+    )
+    await library
+
+    logger.info(f"Successfully ingested data for user {user_id}")
+
+
+async def enrich_catalog(user_id: str, catalog, tracks: list[dict]) -> None:
+    """
+    Add full objects for the artists on a user's top tracks and the tracks'
+    audio features to the catalog
 
-        # Fetch top artists and tracks
-        artists_data = await get_top_artists(access_token, limit=50)
-        tracks_data = await get_top_tracks(access_token, limit=50)
+    Best effort: failures are logged and the next ingest fills the gaps.
+    """
+    artist_ids = [
+        artist["id"]
+        for track in tracks
+        for artist in track.get("artists") or []
+        if artist.get("id")
+    ]
+    try:
+        fetched = await catalog_enricher.enrich(
+            catalog, artist_ids, [track["id"] for track in tracks]
+        )
+    except Exception as e:
+        logger.warning(f"Catalog enrichment for user {user_id} failed: {e}")
+        return
+    logger.debug(f"Enriched catalog for user {user_id}: {fetched}")
 
-        # Upload to GCS
-        storage_service.upload_json(artists_data, f"{user_id}/artists.json")
-        storage_service.upload_json(tracks_data, f"{user_id}/tracks.json")
 
-        logger.info(f"Successfully ingested data for user {user_id}")
-    except Exception as e:
-        logger.error(f"Error ingesting data for user {user_id}: {str(e)}")
+def apply_user_update(user_id: str, features: dict[str, float]) -> None:
+    """Store a user's new taste vector and patch the affected match lists"""
+    row = match_index.update_user(user_id, features)
+    lsh_index.update_user(user_id, features)
+    changed = match_cache.refresh_user(user_id, row)
+    logger.debug(f"Match update for {user_id} touched {changed} cached lists")
+
+
+async def on_user_updated(event: dict) -> None:
+    """USER_UPDATED handler: make the user matchable within seconds of ingest"""
+    await asyncio.to_thread(apply_user_update, event["user_id"], event["features"])
+
+
+events.subscribe(USER_UPDATED, on_user_updated)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,74 @@
+"""In-process TTL cache for Spotify API responses"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after a fixed TTL"""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600):
+        """
+        Args:
+            maxsize: Maximum number of entries kept before evicting the least recently used
+            ttl: Seconds an entry stays valid after it is set
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None if missing or expired"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value under key, evicting the least recently used entries if full"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """Remove key if present"""
+        self._data.pop(key, None)
+
+    def invalidate_user(self, user_id: str) -> int:
+        """
+        Drop every entry whose key is a tuple starting with user_id
+
+        Returns:
+            Number of entries removed
+        """
+        stale = [
+            key
+            for key in self._data
+            if isinstance(key, tuple) and key and key[0] == user_id
+        ]
+        for key in stale:
+            del self._data[key]
+        return len(stale)
+
+    def items(self) -> list[tuple[Hashable, Any]]:
+        """Snapshot of the unexpired (key, value) pairs, least recently used first"""
+        now = time.monotonic()
+        return [
+            (key, value)
+            for key, (expires_at, value) in self._data.items()
+            if expires_at > now
+        ]
+
+    def clear(self) -> None:
+        """Remove all entries"""
+        self._data.clear()
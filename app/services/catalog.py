@@ -0,0 +1,192 @@
+"""Shared catalog of artist and track objects, deduplicated across users"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+
+from google.api_core.exceptions import NotFound
+
+from app.services.cache import TTLCache
+from app.services.codec import json_digest
+from app.services.storage import StorageService, get_storage_service
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PREFIX = "catalog/"
+
+# Catalog objects kept in memory; a popular artist is then read or written once
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "20000"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "86400"))
+
+# Catalog objects uploaded or downloaded concurrently
+CATALOG_WORKERS = int(os.getenv("CATALOG_WORKERS", "16"))
+_catalog_executor = ThreadPoolExecutor(
+    max_workers=CATALOG_WORKERS, thread_name_prefix="catalog"
+)
+
+
+def catalog_blob_name(kind: str, item_id: str) -> str:
+    """Blob holding one artist or track object, e.g. 'catalog/artists/{id}.json'"""
+    return f"{CATALOG_PREFIX}{kind}/{item_id}.json"
+
+
+def split_snapshot(kind: str, data: dict) -> tuple[dict, list[dict]]:
+    """
+    Split a top artists/tracks response into a ranked ID list and its objects
+
+    The list names the catalog it refers to, so readers can tell it from a
+    snapshot written before the catalog existed:
+    {"catalog": "artists", "items": [{"id": ..., "rank": 1}, ...]}.
+
+    Returns:
+        (per-user snapshot, artist or track objects for the catalog)
+    """
+    ranked = []
+    items = []
+    for rank, item in enumerate((data or {}).get("items") or [], start=1):
+        if item and item.get("id"):
+            ranked.append({"id": item["id"], "rank": rank})
+            items.append(item)
+    return {"catalog": kind, "items": ranked}, items
+
+
+class CatalogStore:
+    """
+    Artist and track objects stored once per ID under CATALOG_PREFIX
+
+    Per-user snapshots only hold ranked IDs; the objects live in one blob per
+    artist or track, written with upload_json so unchanged objects are not
+    rewritten and concurrent writers cannot clobber each other. An LRU of the
+    objects and their content hashes sits in front of the bucket, so objects
+    shared by many users are neither re-uploaded nor re-downloaded. It also
+    remembers IDs Spotify has no object for (see mark_missing), so they are
+    not looked up again until the entry expires. Safe to use from several
+    threads.
+    """
+
+    def __init__(
+        self,
+        storage_service: StorageService,
+        maxsize: int = CATALOG_CACHE_SIZE,
+        ttl: float = CATALOG_CACHE_TTL,
+    ):
+        self.storage = storage_service
+        self._lock = threading.Lock()
+        # (kind, id) -> (content hash, object), or (None, None) if Spotify has none
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _cached(self, kind: str, item_id: str) -> Optional[tuple[str, dict]]:
+        with self._lock:
+            return self._cache.get((kind, item_id))
+
+    def _remember(self, kind: str, item: dict, digest: str) -> None:
+        with self._lock:
+            self._cache.set((kind, item["id"]), (digest, item))
+
+    def mark_missing(self, kind: str, item_ids: Iterable[str]) -> None:
+        """Remember IDs Spotify returned no object for, e.g. tracks without audio features"""
+        with self._lock:
+            for item_id in item_ids:
+                self._cache.set((kind, item_id), (None, None))
+
+    def missing(self, kind: str, item_ids: Iterable[str]) -> set[str]:
+        """The IDs among item_ids marked missing by mark_missing"""
+        return {
+            item_id
+            for item_id in item_ids
+            if (cached := self._cached(kind, item_id)) is not None and cached[1] is None
+        }
+
+    def put(self, kind: str, items: Iterable[dict]) -> int:
+        """
+        Store artist or track objects, skipping those already stored unchanged
+
+        Returns:
+            Number of objects sent to the bucket
+
+        Raises:
+            Exception: If an upload fails
+        """
+        changed = {}
+        for item in items:
+            digest = json_digest(item)
+            cached = self._cached(kind, item["id"])
+            if cached is None or cached[0] != digest:
+                changed[item["id"]] = (item, digest)
+
+        def upload(entry: tuple[dict, str]) -> None:
+            item, digest = entry
+            self.storage.upload_json(item, catalog_blob_name(kind, item["id"]))
+            self._remember(kind, item, digest)
+
+        for _ in _catalog_executor.map(upload, changed.values()):
+            pass
+        return len(changed)
+
+    def get(self, kind: str, item_ids: Iterable[str]) -> dict[str, dict]:
+        """
+        Objects for the given IDs, downloading those not in memory
+
+        Returns:
+            Object by ID; IDs missing from the catalog or marked missing are
+            left out
+
+        Raises:
+            Exception: If a download fails
+        """
+        found = {}
+        missing = []
+        for item_id in dict.fromkeys(item_ids):
+            cached = self._cached(kind, item_id)
+            if cached is None:
+                missing.append(item_id)
+            elif cached[1] is not None:
+                found[item_id] = cached[1]
+
+        def download(item_id: str) -> Optional[dict]:
+            blob = self.storage.bucket.blob(catalog_blob_name(kind, item_id))
+            try:
+                item = self.storage.download_blob_json(blob)
+            except NotFound:
+                return None
+            self._remember(kind, item, json_digest(item))
+            return item
+
+        for item_id, item in zip(missing, _catalog_executor.map(download, missing)):
+            if item is not None:
+                found[item_id] = item
+        return found
+
+    def resolve(self, data: dict) -> dict:
+        """
+        A stored snapshot with full objects in place of catalog IDs
+
+        Snapshots written before the catalog are returned unchanged. Items
+        sit at their rank's position; gaps and IDs missing from the catalog
+        are None, as Spotify's own null items would be.
+        """
+        kind = (data or {}).get("catalog")
+        if kind is None:
+            return data
+        ranked = data.get("items") or []
+        objects = self.get(kind, (entry["id"] for entry in ranked))
+        items = [None] * max((entry["rank"] for entry in ranked), default=0)
+        for entry in ranked:
+            items[entry["rank"] - 1] = objects.get(entry["id"])
+        return {"items": items}
+
+
+_catalog_store: Optional[CatalogStore] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog_store() -> CatalogStore:
+    """Return the process-wide CatalogStore, creating it on first use"""
+    global _catalog_store
+    if _catalog_store is None:
+        with _catalog_lock:
+            if _catalog_store is None:
+                _catalog_store = CatalogStore(get_storage_service())
+    return _catalog_store
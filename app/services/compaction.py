@@ -0,0 +1,322 @@
+"""Compaction of per-user JSON snapshots into date-partitioned columnar files"""
+
+import csv
+import gzip
+import io
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterator, Optional
+
+from google.cloud import storage
+
+from app.services.catalog import CatalogStore
+from app.services.storage import StorageService
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; compacted files fall back to CSV
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+COMPACTED_PREFIX = "compacted/"
+WATERMARK_BLOB = f"{COMPACTED_PREFIX}_watermark.json"
+
+# Rows buffered per output file; bounds memory however many snapshots there are
+COMPACTION_CHUNK_ROWS = int(os.getenv("COMPACTION_CHUNK_ROWS", "100000"))
+
+# Snapshots downloaded concurrently
+COMPACTION_WORKERS = int(os.getenv("COMPACTION_WORKERS", "8"))
+
+TIME_RANGES = ["short_term", "medium_term", "long_term"]
+
+# Output columns and their types for each kind of snapshot
+COLUMNS = {
+    "artists": {
+        "user_id": "string",
+        "time_range": "string",
+        "rank": "int32",
+        "artist_id": "string",
+        "name": "string",
+        "popularity": "int32",
+        "followers": "int64",
+        "genres": "string",
+        "snapshot_at": "timestamp",
+    },
+    "tracks": {
+        "user_id": "string",
+        "time_range": "string",
+        "rank": "int32",
+        "track_id": "string",
+        "name": "string",
+        "album_id": "string",
+        "album_name": "string",
+        "artist_ids": "string",
+        "artist_names": "string",
+        "popularity": "int32",
+        "duration_ms": "int64",
+        "snapshot_at": "timestamp",
+    },
+}
+
+# Multi-valued fields are joined into a single column
+LIST_SEPARATOR = "|"
+
+
+def parse_snapshot_name(blob_name: str) -> Optional[tuple[str, str, str]]:
+    """
+    Split a snapshot blob name into (user_id, kind, time_range)
+
+    Returns None for anything that is not a top artists/tracks snapshot
+    written by snapshot_blob_name, e.g. library NDJSON or compacted output.
+    """
+    user_id, _, filename = blob_name.rpartition("/")
+    if not user_id or "/" in user_id or not filename.endswith(".json"):
+        return None
+    kind, _, time_range = filename.removesuffix(".json").partition("_")
+    time_range = time_range or "medium_term"
+    if kind not in COLUMNS or time_range not in TIME_RANGES:
+        return None
+    return user_id, kind, time_range
+
+
+def flatten_snapshot(
+    user_id: str, kind: str, time_range: str, data: dict, snapshot_at: datetime
+) -> Iterator[dict]:
+    """Yield one flat row per ranked artist or track in a snapshot"""
+    for rank, item in enumerate(data.get("items") or [], start=1):
+        if not item:
+            continue
+        row = {
+            "user_id": user_id,
+            "time_range": time_range,
+            "rank": rank,
+            "name": item.get("name"),
+            "popularity": item.get("popularity"),
+            "snapshot_at": snapshot_at,
+        }
+        if kind == "artists":
+            row["artist_id"] = item.get("id")
+            row["followers"] = (item.get("followers") or {}).get("total")
+            row["genres"] = LIST_SEPARATOR.join(item.get("genres") or [])
+        else:
+            album = item.get("album") or {}
+            artists = item.get("artists") or []
+            row["track_id"] = item.get("id")
+            row["album_id"] = album.get("id")
+            row["album_name"] = album.get("name")
+            row["artist_ids"] = LIST_SEPARATOR.join(a.get("id") or "" for a in artists)
+            row["artist_names"] = LIST_SEPARATOR.join(
+                a.get("name") or "" for a in artists
+            )
+            row["duration_ms"] = item.get("duration_ms")
+        yield row
+
+
+def _arrow_schema(kind: str):
+    types = {
+        "string": pa.string(),
+        "int32": pa.int32(),
+        "int64": pa.int64(),
+        "timestamp": pa.timestamp("ms", tz="UTC"),
+    }
+    return pa.schema([(name, types[type_]) for name, type_ in COLUMNS[kind].items()])
+
+
+class CompactionJob:
+    """
+    Batch job turning per-user JSON snapshots into columnar files
+
+    Snapshots updated since the last run's watermark are streamed from the
+    bucket, flattened to one row per ranked artist or track, and written to
+    'compacted/{kind}/date=YYYY-MM-DD/part-*.parquet' (or '.csv.gz' when pyarrow
+    is not installed), partitioned by the day the snapshot was written. At
+    most COMPACTION_CHUNK_ROWS rows are held in memory; the largest partition
+    is flushed to a part file whenever the limit is reached. The watermark only
+    advances once every part has been written, so a failed run is simply retried:
+    part names carry the starting watermark, and a run first deletes any parts
+    an earlier failed attempt left under that name.
+    """
+
+    def __init__(
+        self,
+        storage_service: StorageService,
+        chunk_rows: int = COMPACTION_CHUNK_ROWS,
+        workers: int = COMPACTION_WORKERS,
+        output_format: Optional[str] = None,
+    ):
+        self.storage = storage_service
+        self.bucket = storage_service.bucket
+        self.catalog = CatalogStore(storage_service)
+        self.chunk_rows = chunk_rows
+        self.workers = workers
+        self.output_format = output_format or ("parquet" if pa else "csv")
+        if self.output_format == "parquet" and pa is None:
+            raise ValueError("Parquet output requires pyarrow to be installed")
+
+    def read_watermark(self) -> Optional[datetime]:
+        """Update time of the newest snapshot compacted so far"""
+        data = self.storage.download_json(WATERMARK_BLOB)
+        if not data:
+            return None
+        return datetime.fromisoformat(data["updated"])
+
+    def run(self) -> dict:
+        """
+        Compact every snapshot updated after the watermark
+
+        Snapshots updated while the job runs are left for the next run.
+
+        Returns:
+            Summary with the number of snapshots, rows and files written
+
+        Raises:
+            Exception: If reading a snapshot or writing a part fails
+        """
+        watermark = self.read_watermark()
+        cutoff = datetime.now(timezone.utc)
+        # Part names derive from the starting watermark, so the parts of a
+        # failed attempt at this run can be found and removed; a retry may
+        # split the rows into different parts
+        run_id = (watermark or datetime.fromtimestamp(0, timezone.utc)).strftime(
+            "%Y%m%dT%H%M%S%f"
+        )
+        removed = self._delete_parts(run_id, watermark.date() if watermark else None)
+        if removed:
+            logger.info(f"Removed {removed} parts left by a failed run")
+
+        buffers: dict[tuple[str, str], list[dict]] = {}
+        part_numbers: dict[tuple[str, str], int] = {}
+        summary = {"snapshots": 0, "rows": 0, "files": 0}
+        newest = watermark
+
+        def flush(key: tuple[str, str]) -> None:
+            rows = buffers.pop(key, None)
+            if not rows:
+                return
+            part = part_numbers.get(key, 0)
+            part_numbers[key] = part + 1
+            self._write_part(key, f"{run_id}-{part:05d}", rows)
+            summary["rows"] += len(rows)
+            summary["files"] += 1
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for blob, data in self._download_all(
+                executor, self._pending_blobs(watermark, cutoff)
+            ):
+                user_id, kind, time_range = parse_snapshot_name(blob.name)
+                key = (kind, blob.updated.date().isoformat())
+                buffer = buffers.setdefault(key, [])
+                buffer.extend(
+                    flatten_snapshot(user_id, kind, time_range, data, blob.updated)
+                )
+                # Cap the rows held across all partitions, flushing the largest
+                if sum(map(len, buffers.values())) >= self.chunk_rows:
+                    flush(max(buffers, key=lambda k: len(buffers[k])))
+                summary["snapshots"] += 1
+                if newest is None or blob.updated > newest:
+                    newest = blob.updated
+
+        for key in list(buffers):
+            flush(key)
+
+        if newest is not None and newest != watermark:
+            self.storage.upload_json({"updated": newest.isoformat()}, WATERMARK_BLOB)
+
+        logger.info(
+            f"Compacted {summary['snapshots']} snapshots into "
+            f"{summary['files']} {self.output_format} files ({summary['rows']} rows)"
+        )
+        return summary
+
+    def _delete_parts(self, run_id: str, since: Optional[date]) -> int:
+        """
+        Delete the parts named after run_id
+
+        A run only writes partitions dated on or after its watermark, so with
+        since set only those partitions are listed.
+
+        Returns:
+            Number of parts deleted
+        """
+        marker = f"/part-{run_id}-"
+        prefixes = []
+        for kind in COLUMNS:
+            if since is None:
+                prefixes.append(f"{COMPACTED_PREFIX}{kind}/")
+                continue
+            day = since
+            while day <= datetime.now(timezone.utc).date():
+                prefixes.append(f"{COMPACTED_PREFIX}{kind}/date={day}{marker}")
+                day += timedelta(days=1)
+
+        stale = [
+            blob
+            for prefix in prefixes
+            for blob in self.bucket.list_blobs(prefix=prefix)
+            if marker in blob.name
+        ]
+        for blob in stale:
+            blob.delete()
+        return len(stale)
+
+    def _pending_blobs(
+        self, watermark: Optional[datetime], cutoff: datetime
+    ) -> Iterator[storage.Blob]:
+        """Stream snapshots updated in (watermark, cutoff] from the bucket listing"""
+        for blob in self.bucket.list_blobs():
+            if blob.name.startswith(COMPACTED_PREFIX):
+                continue
+            if parse_snapshot_name(blob.name) is None:
+                continue
+            if watermark is not None and blob.updated <= watermark:
+                continue
+            if blob.updated > cutoff:
+                continue
+            yield blob
+
+    def _download_all(
+        self, executor: ThreadPoolExecutor, blobs: Iterator[storage.Blob]
+    ) -> Iterator[tuple[storage.Blob, dict]]:
+        """Download snapshots in order, with at most two per worker in flight"""
+        in_flight = deque()
+        for blob in blobs:
+            if len(in_flight) >= self.workers * 2:
+                yield in_flight.popleft().result()
+            in_flight.append(executor.submit(self._download, blob))
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    def _download(self, blob: storage.Blob) -> tuple[storage.Blob, dict]:
+        data = self.storage.download_blob_json(blob)
+        return blob, self.catalog.resolve(data)
+
+    def _write_part(self, key: tuple[str, str], part: str, rows: list[dict]) -> None:
+        kind, date = key
+        prefix = f"{COMPACTED_PREFIX}{kind}/date={date}/part-{part}"
+
+        if self.output_format == "parquet":
+            table = pa.Table.from_pylist(rows, schema=_arrow_schema(kind))
+            buffer = io.BytesIO()
+            pq.write_table(table, buffer, compression="zstd")
+            blob = self.bucket.blob(f"{prefix}.parquet")
+            blob.upload_from_string(
+                buffer.getvalue(), content_type="application/vnd.apache.parquet"
+            )
+            return
+
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=list(COLUMNS[kind]))
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, "snapshot_at": row["snapshot_at"].isoformat()})
+        blob = self.bucket.blob(f"{prefix}.csv.gz")
+        blob.upload_from_string(
+            gzip.compress(text.getvalue().encode(), mtime=0),
+            content_type="application/gzip",
+        )
@@ -0,0 +1,36 @@
+"""In-process publish/subscribe of domain events"""
+
+import logging
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+EventHandler = Callable[[dict[str, Any]], Awaitable[None]]
+
+# Published once a user's new snapshots are stored; payload has 'user_id' and
+# 'features' (their taste features, see app.services.matching.user_features)
+USER_UPDATED = "user_updated"
+
+
+class EventBus:
+    """
+    Routes published events to the coroutines subscribed to them
+
+    Handlers run one after another in the publisher's task. A failing handler
+    is logged and does not stop the others or fail the publisher.
+    """
+
+    def __init__(self):
+        self._handlers: dict[str, list[EventHandler]] = {}
+
+    def subscribe(self, event: str, handler: EventHandler) -> None:
+        """Call handler(payload) for every future event of this type"""
+        self._handlers.setdefault(event, []).append(handler)
+
+    async def publish(self, event: str, payload: dict[str, Any]) -> None:
+        """Deliver an event to its subscribers"""
+        for handler in self._handlers.get(event, []):
+            try:
+                await handler(payload)
+            except Exception as e:
+                logger.error(f"Handler {handler.__name__} for {event} failed: {e}")
@@ -0,0 +1,410 @@
+"""Append-only, memory-mapped store of users' taste vectors"""
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+FEATURE_STORE_DIR = os.getenv("FEATURE_STORE_DIR", "feature_store")
+
+# One record per appended row: the interned user it belongs to and the end
+# offset of its entries in indices.bin / data.bin (rows are contiguous)
+ROW_DTYPE = np.dtype([("user", "<i4"), ("end", "<i8")])
+INDEX_DTYPE = np.dtype("<i4")
+VALUE_DTYPE = np.dtype("<f4")
+
+# Superseded rows are rewritten away once they outnumber live ones, checked on
+# open and by compact(), which the app runs every FEATURE_STORE_COMPACT_INTERVAL
+COMPACT_MIN_ROWS = 1024
+FEATURE_STORE_COMPACT_INTERVAL = float(
+    os.getenv("FEATURE_STORE_COMPACT_INTERVAL", "3600")
+)
+
+
+class Snapshot(NamedTuple):
+    """
+    One consistent view of a FeatureStore
+
+    The name lists are those the matrix was built against; a compaction
+    loads new ones, so readers must not mix a snapshot with the store's
+    current attributes.
+    """
+
+    matrix: sparse.csr_matrix  # one row per appended vector
+    row_users: np.ndarray  # interned user of each row
+    latest: np.ndarray  # latest row of each interned user, or -1
+    user_ids: list[str]
+    user_numbers: dict[str, int]
+    features: list[str]
+    generation: int
+    store_id: str
+
+
+def _grow(array: np.ndarray, size: int, fill: int = 0) -> np.ndarray:
+    """Array with room for size items, doubling capacity like a list"""
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[: len(array)] = array
+    if fill:
+        grown[len(array) :] = fill
+    return grown
+
+
+class FeatureStore:
+    """
+    Users' sparse feature vectors as CSR arrays in files, opened with mmap
+
+    Feature names and user IDs are interned to integers in vocab.txt and
+    users.txt. Each vector is appended to indices.bin and data.bin, and a row
+    record naming the user and the end offset is appended to rows.bin last,
+    which commits the row. Re-ingesting a user appends a new row; the latest
+    row for each user is the live one. snapshot() maps the files read-only, so
+    processes serving from the same directory share the pages, and a fresh
+    process can serve queries without parsing anything but the two text
+    files. Writers in several processes are serialised with an flock.
+
+    meta.json names the current generation and a random store_id kept for the
+    life of the directory. Row numbers only mean something within one store,
+    so positions saved elsewhere (see LSHIndex.cursor) carry the ID as well.
+    """
+
+    def __init__(self, directory: str = FEATURE_STORE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._lock_file = open(os.path.join(directory, ".lock"), "a+")
+
+        self.vocab: dict[str, int] = {}
+        self.features: list[str] = []
+        self.user_numbers: dict[str, int] = {}
+        self.user_ids: list[str] = []
+        self._text_offsets = {"vocab.txt": 0, "users.txt": 0}
+
+        self._generation = self._read_generation()
+        self.store_id = ""
+        # -1 until the first load; rows and latest keep spare capacity
+        self._row_count = -1
+        self._rows = np.zeros(0, dtype=ROW_DTYPE)
+        self._latest = np.zeros(0, dtype=np.int64)
+        self._snapshot: Optional[tuple] = None
+
+        with self._flock(fcntl.LOCK_EX):
+            os.makedirs(os.path.dirname(self._path("")), exist_ok=True)
+            self.store_id = self._read_meta().get("id") or ""
+            if not self.store_id:
+                # A new directory, or one written before stores had an ID
+                self.store_id = uuid.uuid4().hex
+                self._write_meta(self._generation)
+            self._repair()
+            self._load()
+            if self._needs_compaction():
+                self._compact()
+                self._load()
+
+    @property
+    def generation(self) -> int:
+        """Bumped by every compaction, which renumbers rows"""
+        return self._generation
+
+    def _path(self, name: str, generation: Optional[int] = None) -> str:
+        """Path of a data file; each compaction writes a new generation directory"""
+        if generation is None:
+            generation = self._generation
+        return os.path.join(self.directory, f"g{generation}", name)
+
+    @contextmanager
+    def _flock(self, operation: int):
+        with self._lock:
+            fcntl.flock(self._lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    # ---------- reading ----------
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(os.path.join(self.directory, "meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _read_generation(self) -> int:
+        return self._read_meta().get("generation", 0)
+
+    def _write_meta(self, generation: int) -> None:
+        """Point meta.json at a generation; the rename makes the switch atomic"""
+        meta_path = os.path.join(self.directory, "meta.json")
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump({"generation": generation, "id": self.store_id}, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+
+    def _read_lines(self, name: str) -> list[str]:
+        """New complete lines of an interning file since it was last read"""
+        path = self._path(name)
+        if not os.path.exists(path):
+            return []
+        with open(path, "rb") as f:
+            f.seek(self._text_offsets[name])
+            chunk = f.read()
+        # A line without its newline is an append still in progress
+        complete = chunk[: chunk.rfind(b"\n") + 1]
+        self._text_offsets[name] += len(complete)
+        return complete.decode().splitlines()
+
+    def _load(self) -> None:
+        """Pick up rows and interned names appended since the last load"""
+        generation = self._read_generation()
+        if generation != self._generation or self._row_count < 0:
+            # First load, or compacted by another process: read the new files
+            self._generation = generation
+            self._text_offsets = {"vocab.txt": 0, "users.txt": 0}
+            self.vocab, self.features = {}, []
+            self.user_numbers, self.user_ids = {}, []
+            self._row_count = 0
+            self._rows = np.zeros(0, dtype=ROW_DTYPE)
+            self._latest = np.zeros(0, dtype=np.int64)
+            self._snapshot = None
+
+        for feature in self._read_lines("vocab.txt"):
+            self.vocab[feature] = len(self.features)
+            self.features.append(feature)
+        for user_id in self._read_lines("users.txt"):
+            self.user_numbers[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        if len(self._latest) < len(self.user_ids):
+            self._latest = _grow(self._latest, len(self.user_ids), fill=-1)
+
+        # Only the rows appended since the last load are read
+        rows_path = self._path("rows.bin")
+        size = os.path.getsize(rows_path) if os.path.exists(rows_path) else 0
+        row_count = size // ROW_DTYPE.itemsize
+        if row_count > self._row_count:
+            new_rows = np.fromfile(
+                rows_path,
+                dtype=ROW_DTYPE,
+                count=row_count - self._row_count,
+                offset=self._row_count * ROW_DTYPE.itemsize,
+            )
+            self._rows = _grow(self._rows, row_count)
+            self._rows[self._row_count : row_count] = new_rows
+            np.maximum.at(
+                self._latest,
+                new_rows["user"],
+                np.arange(self._row_count, row_count),
+            )
+            self._row_count = row_count
+            self._snapshot = None
+
+    def _build_snapshot(self) -> Snapshot:
+        """Map the committed rows as a CSR matrix without copying them"""
+        rows = self._rows[: self._row_count]
+        nnz = int(rows["end"][-1]) if len(rows) else 0
+        indptr = np.zeros(len(rows) + 1, dtype=np.int32)
+        indptr[1:] = rows["end"]
+        if nnz:
+            indices = np.memmap(
+                self._path("indices.bin"), INDEX_DTYPE, "r", shape=(nnz,)
+            )
+            data = np.memmap(self._path("data.bin"), VALUE_DTYPE, "r", shape=(nnz,))
+        else:
+            indices = np.zeros(0, dtype=INDEX_DTYPE)
+            data = np.zeros(0, dtype=VALUE_DTYPE)
+        matrix = sparse.csr_matrix(
+            (data, indices, indptr),
+            shape=(len(rows), len(self.features)),
+            copy=False,
+        )
+        # A compaction replaces these containers instead of clearing them, and
+        # other loads only append, so the snapshot can share them
+        return Snapshot(
+            matrix,
+            rows["user"].copy(),
+            self._latest[: len(self.user_ids)].copy(),
+            self.user_ids,
+            self.user_numbers,
+            self.features,
+            self._generation,
+            self.store_id,
+        )
+
+    def refresh(self) -> None:
+        """Pick up rows appended by this or other processes since the last call"""
+        with self._flock(fcntl.LOCK_SH):
+            self._load()
+
+    def snapshot(self) -> Snapshot:
+        """Current matrix and row bookkeeping, rebuilt only after rows are added"""
+        with self._lock:
+            self.refresh()
+            if self._snapshot is None:
+                self._snapshot = self._build_snapshot()
+            return self._snapshot
+
+    # ---------- writing ----------
+
+    def _append_lines(self, name: str, lines: list[str]) -> None:
+        with open(self._path(name), "ab") as f:
+            f.write("".join(f"{line}\n" for line in lines).encode())
+
+    def _repair(self) -> None:
+        """Drop anything written after the last committed row (after a crash)"""
+        rows_path = self._path("rows.bin")
+        size = os.path.getsize(rows_path) if os.path.exists(rows_path) else 0
+        row_count = size // ROW_DTYPE.itemsize
+        if size != row_count * ROW_DTYPE.itemsize:
+            os.truncate(rows_path, row_count * ROW_DTYPE.itemsize)
+        nnz = 0
+        if row_count:
+            offset = (row_count - 1) * ROW_DTYPE.itemsize
+            last = np.fromfile(rows_path, ROW_DTYPE, count=1, offset=offset)
+            nnz = int(last["end"][0])
+        for name, dtype in (("indices.bin", INDEX_DTYPE), ("data.bin", VALUE_DTYPE)):
+            path = self._path(name)
+            if os.path.exists(path) and os.path.getsize(path) != nnz * dtype.itemsize:
+                os.truncate(path, nnz * dtype.itemsize)
+        for name in ("vocab.txt", "users.txt"):
+            path = self._path(name)
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                content = f.read()
+            if content and not content.endswith(b"\n"):
+                os.truncate(path, content.rfind(b"\n") + 1)
+
+    def append(
+        self, user_id: str, features: Iterable[str], values: Iterable[float]
+    ) -> int:
+        """
+        Append a user's vector, replacing any previous one
+
+        Args:
+            user_id: Spotify user ID
+            features: Feature names, e.g. 'artist:{id}'
+            values: Weight of each feature, in the same order
+
+        Returns:
+            Row number of the appended vector
+        """
+        features = list(features)
+        values = np.fromiter(values, dtype=VALUE_DTYPE, count=len(features))
+        with self._flock(fcntl.LOCK_EX):
+            # Intern against names other processes may have added meanwhile
+            self._load()
+            new_features = [
+                feature
+                for feature in dict.fromkeys(features)
+                if feature not in self.vocab
+            ]
+            if new_features:
+                self._append_lines("vocab.txt", new_features)
+            new_user = user_id not in self.user_numbers
+            if new_user:
+                self._append_lines("users.txt", [user_id])
+            self._load()
+
+            columns = np.fromiter(
+                (self.vocab[feature] for feature in features),
+                dtype=INDEX_DTYPE,
+                count=len(features),
+            )
+            order = np.argsort(columns)
+            columns, values = columns[order], values[order]
+            start = (
+                int(self._rows["end"][self._row_count - 1]) if self._row_count else 0
+            )
+            end = start + len(columns)
+            if end >= 2**31:
+                raise ValueError("Feature store is full; compact or shard it")
+
+            with open(self._path("indices.bin"), "ab") as f:
+                columns.tofile(f)
+            with open(self._path("data.bin"), "ab") as f:
+                values.tofile(f)
+            record = np.array([(self.user_numbers[user_id], end)], dtype=ROW_DTYPE)
+            with open(self._path("rows.bin"), "ab") as f:
+                record.tofile(f)
+            self._load()
+            return self._row_count - 1
+
+    def _needs_compaction(self) -> bool:
+        live = int((self._latest[: len(self.user_ids)] >= 0).sum())
+        return self._row_count >= COMPACT_MIN_ROWS and self._row_count > 2 * live
+
+    def compact(self) -> bool:
+        """
+        Compact the store if superseded rows outnumber live ones
+
+        Safe to call from every process sharing the directory: the first one
+        compacts and the others find nothing to do.
+
+        Returns:
+            Whether the store was compacted
+        """
+        with self._flock(fcntl.LOCK_EX):
+            self._load()
+            if not self._needs_compaction():
+                return False
+            self._compact()
+            self._load()
+            return True
+
+    def _compact(self) -> None:
+        """Rewrite the store keeping only each user's latest row"""
+        matrix, row_users, latest, *_ = self._build_snapshot()
+        live = latest[latest >= 0]
+        live.sort()
+        live_users = row_users[live]
+        matrix = matrix[live]
+        # Keep only the features still in use, renumbered in order
+        used = np.unique(matrix.indices)
+        remap = np.full(len(self.features), -1, dtype=INDEX_DTYPE)
+        remap[used] = np.arange(len(used), dtype=INDEX_DTYPE)
+
+        # Write the next generation in full, then switch meta.json over to it
+        generation = self._generation + 1
+        directory = os.path.dirname(self._path("", generation))
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+        def write_file(name: str, write) -> None:
+            with open(self._path(name, generation), "wb") as f:
+                write(f)
+
+        write_file("indices.bin", lambda f: remap[matrix.indices].tofile(f))
+        write_file("data.bin", lambda f: np.asarray(matrix.data, VALUE_DTYPE).tofile(f))
+        records = np.zeros(len(live), dtype=ROW_DTYPE)
+        records["user"] = np.arange(len(live))
+        records["end"] = matrix.indptr[1:]
+        write_file("rows.bin", records.tofile)
+        write_file(
+            "vocab.txt",
+            lambda f: f.write("".join(f"{self.features[i]}\n" for i in used).encode()),
+        )
+        write_file(
+            "users.txt",
+            lambda f: f.write(
+                "".join(f"{self.user_ids[u]}\n" for u in live_users).encode()
+            ),
+        )
+        self._write_meta(generation)
+        # Processes still mapping the old files keep them until they refresh
+        shutil.rmtree(os.path.dirname(self._path("")), ignore_errors=True)
+        logger.info(
+            f"Compacted feature store from {self._row_count} to {len(live)} rows"
+        )
+
+    def close(self) -> None:
+        self._lock_file.close()
@@ -1,85 +1,129 @@
 """Frontend HTML templates for Spotify Stats app"""
 
+import gzip
+import hashlib
+from pathlib import Path
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+
+# Asset URLs carry a content hash, so they can be cached forever
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Pages must be revalidated, which is cheap thanks to the ETag
+PAGE_CACHE_CONTROL = "no-cache"
+DASHBOARD_CACHE_CONTROL = "private, no-cache"
+
+# Preferred order when the client accepts several encodings
+ENCODING_PREFERENCE = ["br", "gzip", "identity"]
+
+
+class StaticAsset:
+    """A response body compressed once up front and served with a strong ETag"""
+
+    def __init__(self, body: bytes, media_type: str):
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.bodies = {"identity": body, "gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body, quality=11)
+
+    def etag(self, encoding: str) -> str:
+        """Strong ETag of the representation in the given encoding"""
+        if encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """Pick the best available encoding allowed by an Accept-Encoding header"""
+        accepted = set()
+        for part in accept_encoding.split(","):
+            coding, *params = [item.strip() for item in part.split(";")]
+            quality = 1.0
+            for param in params:
+                name, _, value = param.partition("=")
+                if name.strip() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if coding and quality > 0:
+                accepted.add(coding.lower())
+
+        for encoding in ENCODING_PREFERENCE:
+            if encoding in self.bodies and (encoding in accepted or "*" in accepted):
+                return encoding
+        return "identity"
+
+    def response(self, request: Request, cache_control: str) -> Response:
+        """Serve the asset, answering 304 when the client already has it"""
+        encoding = self.negotiate(request.headers.get("accept-encoding", ""))
+        etag = self.etag(encoding)
+        headers = {
+            "ETag": etag,
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+        }
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if "*" in tags or etag in tags:
+                return Response(status_code=304, headers=headers)
+
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(
+            content=self.bodies[encoding], media_type=self.media_type, headers=headers
+        )
+
+
+def _load_assets() -> dict[str, StaticAsset]:
+    """Read app/static and key each file by its fingerprinted name"""
+    media_types = {
+        ".css": "text/css; charset=utf-8",
+        ".js": "text/javascript; charset=utf-8",
+    }
+    assets = {}
+    for path in sorted(STATIC_DIR.iterdir()):
+        if path.suffix not in media_types:
+            continue
+        assets[path.name] = StaticAsset(path.read_bytes(), media_types[path.suffix])
+    return assets
+
+
+_SOURCE_ASSETS = _load_assets()
+
+# Fingerprinted name (e.g. 'login.1a2b3c4d.css') -> asset, served under /static/
+STATIC_ASSETS = {
+    f"{Path(name).stem}.{asset.digest[:8]}{Path(name).suffix}": asset
+    for name, asset in _SOURCE_ASSETS.items()
+}
+
+
+def asset_url(name: str) -> str:
+    """URL of the fingerprinted version of a file in app/static"""
+    path = Path(name)
+    return f"/static/{path.stem}.{_SOURCE_ASSETS[name].digest[:8]}{path.suffix}"
+
 
 def get_login_page():
     """Return the login page HTML"""
-    return """
+    return f"""
     <!DOCTYPE html>
     <html lang="en">
     <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>Spotify Stats</title>
-        <style>
-            * {
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }
-
-            body {
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-                background: linear-gradient(135deg, #0f0f0f 0%, #1a1a1a 100%);
-                min-height: 100vh;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                color: #ffffff;
-            }
-
-            .container {
-                max-width: 500px;
-                width: 90%;
-                text-align: center;
-            }
-
-            .logo {
-                font-size: 48px;
-                margin-bottom: 20px;
-            }
-
-            h1 {
-                font-size: 32px;
-                font-weight: 700;
-                margin-bottom: 10px;
-                letter-spacing: -0.5px;
-            }
-
-            .subtitle {
-                color: #b3b3b3;
-                font-size: 16px;
-                margin-bottom: 40px;
-            }
-
-            .login-button {
-                background-color: #1db954;
-                color: #ffffff;
-                border: none;
-                padding: 14px 32px;
-                font-size: 16px;
-                font-weight: 600;
-                border-radius: 24px;
-                cursor: pointer;
-                transition: all 0.3s ease;
-                width: 100%;
-                letter-spacing: 0.5px;
-            }
-
-            .login-button:hover {
-                background-color: #1ed760;
-                transform: scale(1.02);
-            }
-
-            .login-button:active {
-                transform: scale(0.98);
-            }
-
-            .footer {
-                margin-top: 60px;
-                font-size: 12px;
-                color: #666666;
-            }
-        </style>
+        <link rel="stylesheet" href="{asset_url("login.css")}">
+        <script src="{asset_url("login.js")}" defer></script>
     </head>
     <body>
         <div class="container">
@@ -91,14 +135,6 @@ def get_login_page():
                 <p>Secure • Private • No data stored</p>
             </div>
         </div>
-
-        <script>
-            async function authorize() {
-                const res = await fetch('/api/auth/authorize');
-                const data = await res.json();
-                window.location.href = data.auth_url;
-            }
-        </script>
     </body>
     </html>
     """
@@ -106,282 +142,15 @@ def get_login_page():
 
 def get_dashboard_page():
     """Return the authenticated dashboard page HTML"""
-    return """
+    return f"""
     <!DOCTYPE html>
     <html lang="en">
     <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
         <title>Spotify Stats - Dashboard</title>
-        <style>
-            * {
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }
-
-            body {
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-                background: linear-gradient(135deg, #0f0f0f 0%, #1a1a1a 100%);
-                min-height: 100vh;
-                color: #ffffff;
-            }
-
-            .header {
-                background: rgba(0, 0, 0, 0.4);
-                padding: 20px;
-                border-bottom: 1px solid #282828;
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-            }
-
-            .header h1 {
-                font-size: 24px;
-                font-weight: 700;
-                display: flex;
-                align-items: center;
-                gap: 10px;
-            }
-
-            .logout-btn {
-                background-color: #333333;
-                color: #ffffff;
-                border: none;
-                padding: 8px 16px;
-                border-radius: 20px;
-                cursor: pointer;
-                transition: all 0.3s ease;
-                font-size: 14px;
-            }
-
-            .logout-btn:hover {
-                background-color: #1db954;
-            }
-
-            .container {
-                max-width: 1200px;
-                margin: 0 auto;
-                padding: 40px 20px;
-            }
-
-            .fetch-section {
-                background: rgba(30, 30, 30, 0.8);
-                border: 1px solid #282828;
-                border-radius: 8px;
-                padding: 24px;
-                margin-bottom: 24px;
-            }
-
-            .fetch-section h2 {
-                font-size: 20px;
-                margin-bottom: 8px;
-            }
-
-            .fetch-section p {
-                color: #b3b3b3;
-                margin-bottom: 16px;
-            }
-
-            .fetch-btn {
-                background-color: #1db954;
-                color: #ffffff;
-                border: none;
-                padding: 10px 24px;
-                border-radius: 24px;
-                cursor: pointer;
-                font-weight: 600;
-                transition: all 0.3s ease;
-            }
-
-            .fetch-btn:hover:not(:disabled) {
-                background-color: #1ed760;
-                transform: scale(1.02);
-            }
-
-            .fetch-btn:disabled {
-                opacity: 0.6;
-                cursor: not-allowed;
-            }
-
-            .error {
-                background-color: #ff4444;
-                color: #ffffff;
-                padding: 16px;
-                border-radius: 8px;
-                margin: 20px 0;
-                display: none;
-            }
-
-            .success {
-                background-color: #1db954;
-                color: #ffffff;
-                padding: 16px;
-                border-radius: 8px;
-                margin: 20px 0;
-                display: none;
-            }
-
-            .loading {
-                text-align: center;
-                padding: 40px;
-                display: none;
-            }
-
-            .spinner {
-                border: 4px solid #333333;
-                border-top: 4px solid #1db954;
-                border-radius: 50%;
-                width: 40px;
-                height: 40px;
-                animation: spin 1s linear infinite;
-                margin: 0 auto 20px;
-            }
-
-            @keyframes spin {
-                0% { transform: rotate(0deg); }
-                100% { transform: rotate(360deg); }
-            }
-
-            .results {
-                background: rgba(30, 30, 30, 0.8);
-                border: 1px solid #282828;
-                border-radius: 8px;
-                padding: 24px;
-                margin-top: 24px;
-                display: none;
-            }
-
-            .results h3 {
-                font-size: 20px;
-                margin-bottom: 20px;
-            }
-
-            .artist-grid {
-                display: grid;
-                grid-template-columns: repeat(auto-fill, minmax(150px, 1fr));
-                gap: 16px;
-                margin-bottom: 20px;
-            }
-
-            .artist-card {
-                background: rgba(40, 40, 40, 0.6);
-                border-radius: 8px;
-                padding: 12px;
-                text-align: center;
-                cursor: pointer;
-                transition: all 0.3s ease;
-                border: 1px solid #282828;
-            }
-
-            .artist-card:hover {
-                background: rgba(50, 50, 50, 0.8);
-                border-color: #1db954;
-            }
-
-            .artist-image {
-                width: 100%;
-                aspect-ratio: 1;
-                border-radius: 8px;
-                background-color: #282828;
-                margin-bottom: 12px;
-                object-fit: cover;
-            }
-
-            .artist-name {
-                font-size: 14px;
-                font-weight: 600;
-                margin-bottom: 8px;
-                white-space: nowrap;
-                overflow: hidden;
-                text-overflow: ellipsis;
-            }
-
-            .artist-rank {
-                font-size: 12px;
-                color: #1db954;
-                font-weight: 700;
-            }
-
-            .pagination {
-                display: flex;
-                gap: 8px;
-                justify-content: center;
-                margin-top: 20px;
-            }
-
-            .page-btn {
-                background-color: #333333;
-                color: #ffffff;
-                border: 1px solid #282828;
-                padding: 8px 12px;
-                border-radius: 4px;
-                cursor: pointer;
-                transition: all 0.3s ease;
-            }
-
-            .page-btn:hover:not(:disabled) {
-                background-color: #1db954;
-            }
-
-            .page-btn.active {
-                background-color: #1db954;
-            }
-
-            .page-btn:disabled {
-                opacity: 0.5;
-                cursor: not-allowed;
-            }
-
-            .features-card {
-                background: rgba(40, 40, 40, 0.6);
-                border: 1px solid #282828;
-                border-radius: 8px;
-                padding: 20px;
-            }
-
-            .feature-item {
-                margin-bottom: 20px;
-            }
-
-            .feature-label {
-                font-size: 14px;
-                color: #b3b3b3;
-                margin-bottom: 8px;
-            }
-
-            .feature-value {
-                font-size: 18px;
-                font-weight: 600;
-                margin-bottom: 8px;
-            }
-
-            .feature-bar {
-                background-color: #282828;
-                border-radius: 4px;
-                height: 8px;
-                overflow: hidden;
-            }
-
-            .feature-bar-fill {
-                background-color: #1db954;
-                height: 100%;
-                border-radius: 4px;
-                transition: width 0.3s ease;
-            }
-
-            .track-name {
-                 font-size: 22px;
-                 font-weight: 700;
-                 color: #ffffff;
-             }
-
-             .track-title .track-artist {
-                 font-size: 14px;
-                 color: #b3b3b3;
-                 margin-top: 5px;
-             }
-            </style>
+        <link rel="stylesheet" href="{asset_url("dashboard.css")}">
+        <script src="{asset_url("dashboard.js")}" defer></script>
     </head>
     <body>
         <div class="header">
@@ -415,117 +184,11 @@ def get_dashboard_page():
                  <div class="features-card" id="features-card"></div>
              </div>
         </div>
-
-        <script>
-            const ARTISTS_PER_PAGE = 10;
-            let allArtists = [];
-            let currentPage = 1;
-
-            async function logout() {
-                try {
-                    await fetch('/api/auth/logout', { 
-                        method: 'POST',
-                        credentials: 'include'
-                    });
-                } catch (err) {
-                    console.error('Logout error:', err);
-                }
-                window.location.href = '/';
-            }
-
-            async function fetchTopArtists() {
-                document.getElementById('fetch-btn').disabled = true;
-                document.getElementById('loading').style.display = 'block';
-                document.getElementById('error-message').style.display = 'none';
-                document.getElementById('success-message').style.display = 'none';
-                document.getElementById('results').style.display = 'none';
-
-                try {
-                    const res = await fetch(`/api/data/top-artists?limit=50`, {
-                        credentials: 'include'
-                    });
-                    if (!res.ok) throw new Error('Failed to fetch artists');
-
-                    const data = await res.json();
-                    allArtists = data.items || [];
-
-                    if (allArtists.length === 0) {
-                        showError('No artists found. Try again later.');
-                        return;
-                    }
-
-                    currentPage = 1;
-                    displayArtists();
-                    showSuccess(`Successfully fetched and saved ${allArtists.length} artists!`);
-                    document.getElementById('results').style.display = 'block';
-                } catch (err) {
-                    console.error('Error:', err);
-                    showError('Failed to fetch artists. Please try again.');
-                } finally {
-                    document.getElementById('loading').style.display = 'none';
-                    document.getElementById('fetch-btn').disabled = false;
-                }
-            }
-
-            function displayArtists() {
-                const grid = document.getElementById('artists-grid');
-                grid.innerHTML = '';
-
-                const start = (currentPage - 1) * ARTISTS_PER_PAGE;
-                const end = start + ARTISTS_PER_PAGE;
-                const pageArtists = allArtists.slice(start, end);
-
-                pageArtists.forEach((artist, index) => {
-                    const rank = start + index + 1;
-                    const card = document.createElement('div');
-                    card.className = 'artist-card';
-                    card.innerHTML = `
-                        ${artist.images && artist.images[0] ? `<img src="${artist.images[0].url}" alt="${artist.name}" class="artist-image">` : '<div class="artist-image"></div>'}
-                        <div class="artist-name">${artist.name}</div>
-                        <div class="artist-rank">#${rank}</div>
-                    `;
-                    grid.appendChild(card);
-                });
-
-                updatePagination();
-            }
-
-            function updatePagination() {
-                const totalPages = Math.ceil(allArtists.length / ARTISTS_PER_PAGE);
-                const pagination = document.getElementById('pagination');
-                pagination.innerHTML = '';
-
-                for (let i = 1; i <= totalPages; i++) {
-                    const btn = document.createElement('button');
-                    btn.className = `page-btn ${i === currentPage ? 'active' : ''}`;
-                    btn.textContent = i;
-                    btn.disabled = i === currentPage;
-                    btn.onclick = () => {
-                        currentPage = i;
-                        displayArtists();
-                    };
-                    pagination.appendChild(btn);
-                }
-            }
-
-            function showError(message) {
-                const errorDiv = document.getElementById('error-message');
-                errorDiv.textContent = message;
-                errorDiv.style.display = 'block';
-            }
-
-            function showSuccess(message) {
-                 const successDiv = document.getElementById('success-message');
-                 successDiv.textContent = message;
-                 successDiv.style.display = 'block';
-             }
-
-             window.addEventListener('load', () => {
-                 // Session authentication is handled by cookies automatically
-                 // If user is not authenticated, the API will return 401
-                 // and redirect will happen from the fetch error handler
-             });
-        </script>
     </body>
     </html>
     """
+
+
+# Pages are rendered and compressed once, at import
+LOGIN_PAGE = StaticAsset(get_login_page().encode(), "text/html; charset=utf-8")
+DASHBOARD_PAGE = StaticAsset(get_dashboard_page().encode(), "text/html; charset=utf-8")
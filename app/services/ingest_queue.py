@@ -0,0 +1,261 @@
+"""Durable SQLite-backed queue for background ingest jobs"""
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+IngestHandler = Callable[[str], Awaitable[None]]
+
+
+class IngestQueue:
+    """
+    Job queue persisted in SQLite and drained by a bounded pool of async workers
+
+    Jobs are keyed by user_id, so enqueueing a user that already has a pending
+    job refreshes that job instead of adding a second one. Enqueueing a user
+    whose job is running counts as a new request: the job runs again once it
+    finishes, so changes made meanwhile are not lost. Failed jobs are
+    retried with exponential backoff up to max_attempts, unless the error is
+    one of permanent_errors, which no retry can fix. A worker renews its
+    job's lease while the handler runs, so a job claimed by a worker that
+    dies is picked up again once its lease expires, however long jobs take.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        handler: IngestHandler,
+        workers: int = 4,
+        max_attempts: int = 5,
+        backoff: float = 5.0,
+        lease: float = 300.0,
+        poll_interval: float = 5.0,
+        permanent_errors: tuple[type[Exception], ...] = (),
+    ):
+        """
+        Args:
+            path: SQLite database file holding the jobs
+            handler: Coroutine called as handler(user_id) for each job
+            workers: Number of jobs processed concurrently
+            max_attempts: Attempts before a job is dropped
+            backoff: Base delay in seconds before the first retry, doubled each attempt
+            lease: Seconds without a renewal after which a claimed job is retried
+            poll_interval: Seconds an idle worker waits before checking for due jobs
+            permanent_errors: Exceptions that drop a job at once instead of retrying
+        """
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.permanent_errors = permanent_errors
+
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_jobs (
+                user_id TEXT PRIMARY KEY,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                run_at REAL NOT NULL,
+                claimed_at REAL,
+                last_error TEXT,
+                enqueued INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        columns = {
+            row[1] for row in self._conn.execute("PRAGMA table_info(ingest_jobs)")
+        }
+        if "enqueued" not in columns:
+            # Databases created before re-enqueues were counted
+            self._conn.execute(
+                "ALTER TABLE ingest_jobs ADD COLUMN enqueued INTEGER NOT NULL DEFAULT 0"
+            )
+        self._lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    # ---------- storage ----------
+
+    def _put(self, user_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO ingest_jobs (user_id, run_at)
+                VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    attempts = 0,
+                    run_at = MIN(run_at, excluded.run_at),
+                    enqueued = enqueued + 1
+                """,
+                (user_id, time.time()),
+            )
+
+    def _claim(self) -> Optional[tuple[str, int, int]]:
+        """Lease the next due job; returns (user_id, attempts, enqueued count)"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT user_id, attempts, enqueued FROM ingest_jobs
+                    WHERE run_at <= ? AND (claimed_at IS NULL OR claimed_at < ?)
+                    ORDER BY run_at LIMIT 1
+                    """,
+                    (now, now - self.lease),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE ingest_jobs SET claimed_at = ? WHERE user_id = ?",
+                        (now, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def _renew(self, user_id: str) -> None:
+        # A job already released by _fail stays released
+        with self._lock:
+            self._conn.execute(
+                """
+                UPDATE ingest_jobs SET claimed_at = ?
+                WHERE user_id = ? AND claimed_at IS NOT NULL
+                """,
+                (time.time(), user_id),
+            )
+
+    def _finish(self, user_id: str, enqueued: int) -> bool:
+        """
+        Delete a claimed job, unless it was enqueued again since it was claimed
+
+        A job enqueued again is released instead, to run once more from the
+        first attempt. Must hold self._lock.
+
+        Returns:
+            True if the job was deleted
+        """
+        deleted = self._conn.execute(
+            "DELETE FROM ingest_jobs WHERE user_id = ? AND enqueued = ?",
+            (user_id, enqueued),
+        ).rowcount
+        if not deleted:
+            self._conn.execute(
+                """
+                UPDATE ingest_jobs
+                SET attempts = 0, claimed_at = NULL, last_error = NULL
+                WHERE user_id = ?
+                """,
+                (user_id,),
+            )
+        return bool(deleted)
+
+    def _complete(self, user_id: str, enqueued: int) -> None:
+        with self._lock:
+            self._finish(user_id, enqueued)
+
+    def _fail(self, user_id: str, attempts: int, enqueued: int, error: str) -> bool:
+        """Record a failed attempt; returns False if the job was dropped"""
+        with self._lock:
+            if attempts >= self.max_attempts:
+                return not self._finish(user_id, enqueued)
+            self._conn.execute(
+                """
+                UPDATE ingest_jobs
+                SET attempts = ?, run_at = ?, claimed_at = NULL, last_error = ?
+                WHERE user_id = ?
+                """,
+                (
+                    attempts,
+                    time.time() + self.backoff * 2 ** (attempts - 1),
+                    error,
+                    user_id,
+                ),
+            )
+            return True
+
+    def depth(self) -> int:
+        """Number of jobs waiting or in progress"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ingest_jobs").fetchone()[0]
+
+    # ---------- async API ----------
+
+    async def enqueue(self, user_id: str) -> None:
+        """Add or refresh the ingest job for user_id"""
+        await asyncio.to_thread(self._put, user_id)
+        self._wakeup.set()
+
+    async def start(self) -> None:
+        """Start the worker tasks"""
+        self._tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+        logger.info(
+            f"Ingest queue started with {self.workers} workers, {self.depth()} pending"
+        )
+
+    async def stop(self) -> None:
+        """Cancel the workers; unfinished jobs stay in the database"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._conn.close()
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            user_id, attempts, enqueued = job
+            heartbeat = asyncio.create_task(self._heartbeat(user_id))
+            try:
+                try:
+                    await self.handler(user_id)
+                finally:
+                    heartbeat.cancel()
+            except Exception as e:
+                attempts += 1
+                if isinstance(e, self.permanent_errors):
+                    await asyncio.to_thread(self._complete, user_id, enqueued)
+                    logger.error(f"Ingest for user {user_id} dropped: {e}")
+                elif await asyncio.to_thread(
+                    self._fail, user_id, attempts, enqueued, str(e)
+                ):
+                    logger.warning(
+                        f"Ingest for user {user_id} failed (attempt {attempts}), "
+                        f"will retry: {e}"
+                    )
+                else:
+                    logger.error(
+                        f"Ingest for user {user_id} dropped after {attempts} attempts: {e}"
+                    )
+            else:
+                await asyncio.to_thread(self._complete, user_id, enqueued)
+
+    async def _heartbeat(self, user_id: str) -> None:
+        """Renew a running job's lease well before it expires"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await asyncio.to_thread(self._renew, user_id)
+            except Exception as e:
+                logger.warning(f"Failed to renew the lease for user {user_id}: {e}")
@@ -0,0 +1,331 @@
+"""MinHash/LSH index narrowing match queries to a small set of candidates"""
+
+import io
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+from typing import Iterable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Signature length, and how it is cut into bands of LSH_NUM_PERM / LSH_BANDS rows.
+# Users whose artist/genre sets have Jaccard similarity s share at least one
+# band with probability 1 - (1 - s**rows)**bands. Taste overlap is low even
+# between well-matched users, so 64 bands of 2 rows catch about half the
+# pairs at s = 0.1 and nearly all above s = 0.2, while unrelated users
+# (s around 0.01) rarely collide.
+LSH_NUM_PERM = int(os.getenv("LSH_NUM_PERM", "128"))
+LSH_BANDS = int(os.getenv("LSH_BANDS", "64"))
+
+# Where the index is saved on shutdown and loaded from at startup: a blob in
+# the bucket when LSH_INDEX_BLOB is set, otherwise a local file
+LSH_INDEX_PATH = os.getenv("LSH_INDEX_PATH", "lsh_index.npz")
+LSH_INDEX_BLOB = os.getenv("LSH_INDEX_BLOB")
+
+# Only these feature kinds feed the signature; track overlap is too sparse
+LSH_FEATURE_KINDS = ("artist", "genre")
+
+# Largest prime below 2**32; hash values and permutations stay within uint64
+_PRIME = np.uint64(4294967291)
+_SEED = 1
+
+
+def _permutations(num_perm: int) -> tuple[np.ndarray, np.ndarray]:
+    """Coefficients of the universal hashes (a * x + b) mod _PRIME"""
+    rng = random.Random(_SEED)
+    a = np.array([rng.randrange(1, 2**31) for _ in range(num_perm)], dtype=np.uint64)
+    b = np.array([rng.randrange(0, 2**31) for _ in range(num_perm)], dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+
+class LSHIndex:
+    """
+    MinHash signatures of users' artist/genre sets, banded into hash buckets
+
+    A match query only scores the users that share at least one band bucket
+    with the querying user instead of the whole user base. The buckets are
+    one sorted array of keys searched with np.searchsorted; users
+    added or changed since the arrays were sorted sit in a small pending map
+    until the next rebuild. Signatures are deterministic, so the index can be
+    saved with save() and reloaded with load() by a new process. Safe to use
+    from several threads.
+    """
+
+    def __init__(self, num_perm: int = LSH_NUM_PERM, bands: int = LSH_BANDS):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._a, self._b = _permutations(num_perm)
+        # Odd multipliers folding each band's rows into one 64-bit bucket key
+        rng = random.Random(_SEED + 1)
+        self._band_coefficients = np.array(
+            [rng.randrange(1, 2**64, 2) for _ in range(self.rows)], dtype=np.uint64
+        )
+        # Per-band salts, so equal rows in different bands give different keys
+        self._band_salts = np.array(
+            [rng.randrange(0, 2**64) for _ in range(bands)], dtype=np.uint64
+        )
+
+        self._lock = threading.Lock()
+        self._user_ids: list[str] = []
+        self._positions: dict[str, int] = {}
+        # Rows beyond len(self._user_ids) are spare capacity
+        self._signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self._keys = np.zeros((0, bands), dtype=np.uint64)
+        # Every user's bucket keys across all bands, sorted, and their positions
+        self._sorted_keys = np.zeros(0, dtype=np.uint64)
+        self._sorted_positions = np.zeros(0, dtype=np.int32)
+        # Positions added or changed since the sorted arrays were built
+        self._pending: set[int] = set()
+        self.build_seconds = 0.0
+        # Feature store position the index is synced to (see
+        # MatchIndex.changed_since); saved with it so a reload only catches up.
+        # It names the store, so one loaded elsewhere is synced in full.
+        self.cursor: Optional[tuple[str, int, int]] = None
+
+    def __len__(self) -> int:
+        return len(self._user_ids)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._positions
+
+    def signature(self, features: Iterable[str]) -> np.ndarray:
+        """MinHash signature of a set of 'kind:value' features"""
+        hashes = np.fromiter(
+            (
+                zlib.crc32(feature.encode())
+                for feature in features
+                if feature.partition(":")[0] in LSH_FEATURE_KINDS
+            ),
+            dtype=np.uint64,
+        )
+        if hashes.size == 0:
+            return np.full(self.num_perm, np.iinfo(np.uint32).max, dtype=np.uint32)
+        permuted = (self._a * hashes[None, :] + self._b) % _PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """One bucket key per band for each row of signatures (wrapping uint64)"""
+        banded = signatures.astype(np.uint64).reshape(-1, self.bands, self.rows)
+        keys = (banded * self._band_coefficients).sum(axis=2, dtype=np.uint64)
+        return keys ^ self._band_salts
+
+    def update_user(self, user_id: str, features: Iterable[str]) -> None:
+        """Add or replace a user's signature and bucket entries"""
+        started = time.perf_counter()
+        signature = self.signature(features)
+        keys = self._band_keys(signature[None, :])[0]
+        with self._lock:
+            position = self._positions.get(user_id)
+            if position is None:
+                position = len(self._user_ids)
+                self._positions[user_id] = position
+                self._user_ids.append(user_id)
+                self._grow(position + 1)
+            self._signatures[position] = signature
+            self._keys[position] = keys
+            self._pending.add(position)
+            # Re-sort once the pending set would make queries slow
+            if len(self._pending) > max(1024, len(self._user_ids) // 16):
+                self._rebuild()
+            self.build_seconds += time.perf_counter() - started
+
+    def _grow(self, size: int) -> None:
+        """Make room for size users, doubling capacity like a list"""
+        if size <= len(self._signatures):
+            return
+        capacity = max(size, 2 * len(self._signatures))
+        signatures = np.zeros((capacity, self.num_perm), dtype=np.uint32)
+        signatures[: len(self._signatures)] = self._signatures
+        keys = np.zeros((capacity, self.bands), dtype=np.uint64)
+        keys[: len(self._keys)] = self._keys
+        self._signatures, self._keys = signatures, keys
+
+    def _rebuild(self) -> None:
+        """Sort all bucket keys, folding in the pending users"""
+        keys = self._keys[: len(self._user_ids)].ravel()
+        order = np.argsort(keys)
+        self._sorted_keys = keys[order]
+        self._sorted_positions = (order // self.bands).astype(np.int32)
+        self._pending.clear()
+
+    def candidates(self, user_id: str) -> list[str]:
+        """
+        Users sharing at least one band bucket with user_id
+
+        Raises:
+            KeyError: If the user is not in the index
+        """
+        with self._lock:
+            position = self._positions[user_id]
+            keys = self._keys[position]
+            starts = np.searchsorted(self._sorted_keys, keys, side="left")
+            ends = np.searchsorted(self._sorted_keys, keys, side="right")
+            found = np.concatenate(
+                [
+                    self._sorted_positions[start:end]
+                    for start, end in zip(starts.tolist(), ends.tolist())
+                    if end > start
+                ]
+                or [np.zeros(0, dtype=np.int32)]
+            )
+            if self._pending:
+                # Sorted entries of changed users may be stale; check them all
+                pending = np.fromiter(self._pending, dtype=np.int32)
+                found = np.concatenate([found, pending])
+                found = found[(self._keys[found] == keys).any(axis=1)]
+            found = np.unique(found)
+            return [self._user_ids[i] for i in found.tolist() if i != position]
+
+    def memory_bytes(self) -> int:
+        """Memory held by signatures, bucket keys and the sorted buckets"""
+        with self._lock:
+            return (
+                self._signatures.nbytes
+                + self._keys.nbytes
+                + self._sorted_keys.nbytes
+                + self._sorted_positions.nbytes
+                + len(self._pending) * 64
+            )
+
+    def save(self, target) -> None:
+        """Write user IDs and signatures as .npz to a path or binary file object"""
+        with self._lock:
+            count = len(self._user_ids)
+            extra = {}
+            if self.cursor is not None:
+                extra["store_id"] = np.array(self.cursor[0])
+                extra["cursor"] = np.array(self.cursor[1:])
+            np.savez(
+                target,
+                user_ids=np.array(self._user_ids, dtype=str),
+                signatures=self._signatures[:count],
+                params=np.array([self.num_perm, self.bands]),
+                **extra,
+            )
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        self.save(buffer)
+        return buffer.getvalue()
+
+    @classmethod
+    def load(cls, source) -> "LSHIndex":
+        """
+        Read an index written by save() from a path or binary file object
+
+        Raises:
+            ValueError: If it was built with different parameters than this
+                process is configured for
+        """
+        started = time.perf_counter()
+        with np.load(source) as saved:
+            num_perm, bands = (int(value) for value in saved["params"])
+            user_ids = saved["user_ids"].tolist()
+            signatures = saved["signatures"]
+            # Files saved before the cursor named its store are synced in full
+            cursor = (
+                (str(saved["store_id"]), *(int(value) for value in saved["cursor"]))
+                if "store_id" in saved
+                else None
+            )
+        if (num_perm, bands) != (LSH_NUM_PERM, LSH_BANDS):
+            raise ValueError(
+                f"Index built with num_perm={num_perm}, bands={bands}; "
+                f"expected {LSH_NUM_PERM}, {LSH_BANDS}"
+            )
+
+        index = cls(num_perm, bands)
+        index._user_ids = user_ids
+        index._positions = {user_id: i for i, user_id in enumerate(user_ids)}
+        index._signatures = np.array(signatures, dtype=np.uint32)
+        index._keys = index._band_keys(index._signatures)
+        index._rebuild()
+        index.cursor = cursor
+        index.build_seconds = time.perf_counter() - started
+        return index
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "LSHIndex":
+        return cls.load(io.BytesIO(raw))
+
+
+def load_index(storage_service=None) -> Optional[LSHIndex]:
+    """
+    Load the saved index from LSH_INDEX_BLOB or LSH_INDEX_PATH
+
+    Returns:
+        The index, or None if none was saved or it is unusable
+    """
+    try:
+        if LSH_INDEX_BLOB and storage_service is not None:
+            blob = storage_service.bucket.get_blob(LSH_INDEX_BLOB)
+            if blob is None:
+                return None
+            index = LSHIndex.from_bytes(blob.download_as_bytes())
+        elif os.path.exists(LSH_INDEX_PATH):
+            index = LSHIndex.load(LSH_INDEX_PATH)
+        else:
+            return None
+    except Exception as e:
+        logger.warning(f"Ignoring saved LSH index: {e}")
+        return None
+    logger.info(f"Loaded LSH index of {len(index)} users in {index.build_seconds:.2f}s")
+    return index
+
+
+def save_index(index: LSHIndex, storage_service=None) -> None:
+    """
+    Save the index to LSH_INDEX_BLOB or LSH_INDEX_PATH
+
+    Every worker process saves on shutdown and the last one wins. That is
+    safe because each index holds every user in the feature store up to its
+    cursor, and whoever loads it syncs from there.
+    """
+    if LSH_INDEX_BLOB and storage_service is not None:
+        storage_service.bucket.blob(LSH_INDEX_BLOB).upload_from_string(
+            index.to_bytes(), content_type="application/octet-stream"
+        )
+        return
+    # Write next to the target and rename, so a crash never leaves half a file;
+    # per process, so workers shutting down together do not share a temp file
+    tmp_path = f"{LSH_INDEX_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        index.save(f)
+    os.replace(tmp_path, LSH_INDEX_PATH)
+
+
+def measure_recall(
+    lsh: LSHIndex, match_index, user_ids: Iterable[str], k: int = 10
+) -> dict:
+    """
+    Compare LSH-restricted matching against exact scoring for some users
+
+    Returns:
+        Mean recall@k of the candidate-only top k against the exact top k, and
+        the mean fraction of users scored per query
+    """
+    recalls = []
+    scanned = []
+    for user_id in user_ids:
+        exact = {match for match, _ in match_index.top_matches(user_id, k)}
+        if not exact:
+            continue
+        candidates = lsh.candidates(user_id)
+        approximate = {
+            match for match, _ in match_index.top_matches(user_id, k, candidates)
+        }
+        recalls.append(len(exact & approximate) / len(exact))
+        scanned.append(len(candidates) / max(len(match_index) - 1, 1))
+    return {
+        "users": len(recalls),
+        "recall": float(np.mean(recalls)) if recalls else 0.0,
+        "scanned": float(np.mean(scanned)) if scanned else 0.0,
+    }
@@ -0,0 +1,523 @@
+"""Music-taste compatibility scoring between users"""
+
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+from scipy import sparse
+
+from app.services.cache import TTLCache
+from app.services.catalog import CatalogStore
+from app.services.compaction import COMPACTED_PREFIX, parse_snapshot_name
+from app.services.feature_store import FeatureStore, Snapshot
+from app.services.lsh import LSHIndex
+from app.services.precompute import MatchLists
+
+logger = logging.getLogger(__name__)
+
+# Relative weight of each kind of feature in a user's taste vector
+FEATURE_WEIGHTS = {"artist": 1.0, "genre": 0.5, "track": 0.75}
+
+# Relative weight of each snapshot's time range
+TIME_RANGE_WEIGHTS = {"short_term": 0.75, "medium_term": 1.0, "long_term": 1.0}
+
+# Snapshots downloaded concurrently when loading the index from the bucket
+MATCH_LOAD_WORKERS = int(os.getenv("MATCH_LOAD_WORKERS", "16"))
+
+# Matches kept per user by MatchCache; smaller requests are served by slicing
+MATCH_CACHE_K = int(os.getenv("MATCH_CACHE_K", "50"))
+MATCH_CACHE_MAXSIZE = int(os.getenv("MATCH_CACHE_MAXSIZE", "10000"))
+MATCH_CACHE_TTL = float(os.getenv("MATCH_CACHE_TTL", "3600"))
+
+# Precomputed lists are recomputed instead once more users changed since
+MATCH_PATCH_LIMIT = 1000
+
+# Seconds between checks of the feature store for users other processes updated
+MATCH_SYNC_INTERVAL = float(os.getenv("MATCH_SYNC_INTERVAL", "5"))
+
+
+def rank_weight(rank: int) -> float:
+    """Weight of the item at a 1-based rank; the top of a list counts most"""
+    return 1.0 / math.log2(rank + 1)
+
+
+def user_features(
+    snapshots: Iterable[tuple[tuple[str, str], dict]],
+) -> dict[str, float]:
+    """
+    Rank-weighted taste features from a user's top artists/tracks snapshots
+
+    Features are 'artist:{id}', 'track:{id}' and 'genre:{name}'; an artist's
+    genres inherit its weight, so genres shared by many top artists add up.
+
+    Args:
+        snapshots: ((kind, time_range), Spotify response) pairs, where kind is
+            'artists' or 'tracks'
+
+    Returns:
+        Mapping of feature -> weight
+    """
+    features: dict[str, float] = {}
+    for (kind, time_range), data in snapshots:
+        range_weight = TIME_RANGE_WEIGHTS.get(time_range, 1.0)
+        for rank, item in enumerate((data or {}).get("items") or [], start=1):
+            if not item or not item.get("id"):
+                continue
+            weight = range_weight * rank_weight(rank)
+            if kind == "artists":
+                key = f"artist:{item['id']}"
+                features[key] = features.get(key, 0.0) + weight
+                for genre in item.get("genres") or []:
+                    key = f"genre:{genre}"
+                    features[key] = features.get(key, 0.0) + weight
+            else:
+                key = f"track:{item['id']}"
+                features[key] = features.get(key, 0.0) + weight
+    return {
+        feature: weight * FEATURE_WEIGHTS[feature.partition(":")[0]]
+        for feature, weight in features.items()
+    }
+
+
+class MatchIndex:
+    """
+    Users' taste vectors as rows of one sparse matrix, scored by cosine similarity
+
+    Vectors live in a FeatureStore, which interns feature names to column
+    numbers and memory-maps the rows. Each row is L2-normalised, so the
+    similarity of one user to everyone else is a single sparse matrix-vector
+    product. Updating a user appends a new row that supersedes the old one.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, store: FeatureStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._live: tuple[Optional[sparse.csr_matrix], Optional[np.ndarray]] = (
+            None,
+            None,
+        )
+
+    def __len__(self) -> int:
+        return int((self.store.snapshot().latest >= 0).sum())
+
+    def __contains__(self, user_id: str) -> bool:
+        return self._position(user_id, self.store.snapshot()) >= 0
+
+    def _position(self, user_id: str, snapshot: Snapshot) -> int:
+        """Matrix row of a user's current vector, or -1"""
+        number = snapshot.user_numbers.get(user_id)
+        if number is None or number >= len(snapshot.latest):
+            return -1
+        return int(snapshot.latest[number])
+
+    def user_ids(self) -> list[str]:
+        """IDs of every user with a taste vector"""
+        snapshot = self.store.snapshot()
+        return [snapshot.user_ids[u] for u in np.flatnonzero(snapshot.latest >= 0)]
+
+    def iter_features(self) -> Iterator[tuple[str, list[str]]]:
+        """(user_id, feature names) for every user, e.g. to rebuild the LSH index"""
+        _, changed = self.changed_since(None)
+        for user_id, _, features in changed:
+            yield user_id, features
+
+    def changed_since(
+        self, cursor: Optional[tuple[str, int, int]]
+    ) -> tuple[tuple[str, int, int], list[tuple[str, int, list[str]]]]:
+        """
+        Users whose vector was stored after cursor, by this or another process
+
+        Args:
+            cursor: (store ID, store generation, row count) returned by an
+                earlier call, or None for every user. A compaction renumbers
+                rows, so a cursor from an older generation, or from another
+                store, also returns every user.
+
+        Returns:
+            (cursor for the next call, [(user_id, matrix row, feature names)])
+        """
+        snapshot = self.store.snapshot()
+        matrix, latest = snapshot.matrix, snapshot.latest
+        position = (snapshot.store_id, snapshot.generation)
+        start = cursor[2] if cursor is not None and cursor[:2] == position else 0
+        changed = []
+        for row in np.sort(latest[latest >= start]).tolist():
+            columns = matrix.indices[matrix.indptr[row] : matrix.indptr[row + 1]]
+            changed.append(
+                (
+                    snapshot.user_ids[snapshot.row_users[row]],
+                    row,
+                    [snapshot.features[c] for c in columns.tolist()],
+                )
+            )
+        return (*position, matrix.shape[0]), changed
+
+    def update_user(self, user_id: str, features: dict[str, float]) -> int:
+        """
+        Add or replace a user's taste vector
+
+        Returns:
+            Matrix row of the new vector
+        """
+        values = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+        norm = np.linalg.norm(values)
+        if norm > 0:
+            values /= norm
+        return self.store.append(user_id, features, values)
+
+    def matrix(self) -> sparse.csr_matrix:
+        """The rows x features matrix of normalised taste vectors"""
+        return self.store.snapshot().matrix
+
+    def _live_rows(self, matrix: sparse.csr_matrix, latest: np.ndarray) -> np.ndarray:
+        """Mask of the rows that are some user's current vector"""
+        with self._lock:
+            cached_matrix, live = self._live
+            if cached_matrix is not matrix:
+                live = np.zeros(matrix.shape[0], dtype=bool)
+                live[latest[latest >= 0]] = True
+                self._live = (matrix, live)
+            return live
+
+    def score_users(self, user_id: str, others: list[str]) -> np.ndarray:
+        """
+        Cosine similarity of user_id to each of others; 0 for unknown users
+
+        Raises:
+            KeyError: If user_id is not in the index
+        """
+        snapshot = self.store.snapshot()
+        matrix = snapshot.matrix
+        position = self._position(user_id, snapshot)
+        if position < 0:
+            raise KeyError(user_id)
+        rows = np.fromiter(
+            (self._position(other, snapshot) for other in others),
+            dtype=np.int64,
+            count=len(others),
+        )
+        scores = np.zeros(len(others), dtype=np.float32)
+        known = rows >= 0
+        scores[known] = matrix[rows[known]] @ matrix[position].toarray().ravel()
+        return scores
+
+    def top_matches(
+        self, user_id: str, k: int = 10, candidates: Optional[Iterable[str]] = None
+    ) -> list[tuple[str, float]]:
+        """
+        The k users most compatible with user_id, best first
+
+        Args:
+            user_id: User to find matches for
+            k: Number of matches
+            candidates: Only score these users (e.g. from the LSH index)
+                instead of everyone
+
+        Returns:
+            (user_id, cosine similarity) pairs; users sharing nothing are left out
+
+        Raises:
+            KeyError: If the user is not in the index
+        """
+        snapshot = self.store.snapshot()
+        matrix = snapshot.matrix
+        position = self._position(user_id, snapshot)
+        if position < 0:
+            raise KeyError(user_id)
+
+        vector = matrix[position].toarray().ravel()
+        if candidates is None:
+            rows = np.arange(matrix.shape[0])
+            scores = matrix @ vector
+            scores[~self._live_rows(matrix, snapshot.latest)] = -np.inf
+            scores[position] = -np.inf
+        else:
+            rows = np.fromiter(
+                (self._position(c, snapshot) for c in candidates), dtype=np.int64
+            )
+            rows = rows[(rows >= 0) & (rows != position)]
+            scores = matrix[rows] @ vector
+
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        best = np.argpartition(scores, -k)[-k:]
+        best = best[np.argsort(scores[best])[::-1]]
+        return [
+            (snapshot.user_ids[snapshot.row_users[rows[i]]], float(scores[i]))
+            for i in best
+            if scores[i] > 0
+        ]
+
+
+class MatchCache:
+    """
+    Each user's top MATCH_CACHE_K matches, kept current as users change
+
+    Lists are computed on first use, scoring only the user's LSH candidates
+    when there are enough of them. When a user's vector changes,
+    refresh_user() recomputes their list and patches every other cached list
+    instead of dropping it: the changed user is re-scored against all cached
+    users in one sparse product and inserted, moved or removed. A full list
+    the user drops out of is discarded, since its next-best entry is unknown.
+    Users updated by other worker processes are picked up from the shared
+    feature store by sync(). Safe to use from several threads.
+
+    With precomputed MatchLists attached, a cache miss is served from them
+    instead, patched the same way for users that changed since they were
+    generated.
+    """
+
+    def __init__(
+        self,
+        index: MatchIndex,
+        lsh: Optional[LSHIndex] = None,
+        k: int = MATCH_CACHE_K,
+        maxsize: int = MATCH_CACHE_MAXSIZE,
+        ttl: float = MATCH_CACHE_TTL,
+    ):
+        self.index = index
+        self.lsh = lsh
+        self.k = k
+        self._lock = threading.Lock()
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lists: Optional[MatchLists] = None
+        # When each user was last refreshed, to patch precomputed lists
+        self._changed_at: dict[str, float] = {}
+        # Feature store position of the last sync, and rows applied since
+        self._cursor: Optional[tuple[str, int, int]] = None
+        self._applied: dict[str, int] = {}
+
+    def use_lsh(self, lsh: LSHIndex) -> None:
+        """Use another LSH index, e.g. a saved one; sync() resumes at its cursor"""
+        with self._lock:
+            self.lsh = lsh
+            self._cursor = lsh.cursor
+            self._applied = {}
+
+    def use_lists(self, lists: MatchLists) -> None:
+        """Serve cache misses from newly precomputed lists"""
+        with self._lock:
+            self.lists = lists
+            self._changed_at = {
+                user_id: changed_at
+                for user_id, changed_at in self._changed_at.items()
+                if changed_at >= lists.generated_at
+            }
+
+    def compute(
+        self, user_id: str, k: int, exact: bool = False
+    ) -> list[tuple[str, float]]:
+        """
+        Top k matches, scoring only LSH candidates when possible
+
+        Falls back to scoring every user when exact is set, the user is not in
+        the LSH index yet, or it yields fewer than k candidates.
+
+        Raises:
+            KeyError: If the user is not in the index
+        """
+        if not exact and self.lsh is not None and user_id in self.lsh:
+            candidates = self.lsh.candidates(user_id)
+            if len(candidates) >= k:
+                return self.index.top_matches(user_id, k, candidates)
+        return self.index.top_matches(user_id, k)
+
+    def get(self, user_id: str, k: int) -> list[tuple[str, float]]:
+        """
+        The user's top k (at most self.k) matches, from the cache when possible
+
+        Raises:
+            KeyError: If the user is not in the index
+        """
+        with self._lock:
+            matches = self._cache.get(user_id)
+        if matches is None:
+            matches = self._from_lists(user_id)
+        if matches is None:
+            matches = self.compute(user_id, self.k)
+            with self._lock:
+                self._cache.set(user_id, matches)
+        return matches[:k]
+
+    def refresh_user(self, user_id: str, row: Optional[int] = None) -> int:
+        """
+        Recompute a changed user's list and patch the cached lists of others
+
+        Args:
+            user_id: User whose vector changed
+            row: Matrix row of the new vector, so sync() does not apply it again
+
+        Returns:
+            Number of other users' lists that changed or were dropped
+        """
+        matches = self.compute(user_id, self.k)
+        with self._lock:
+            if row is not None:
+                self._applied[user_id] = row
+            self._cache.set(user_id, matches)
+        return self._patch_others(user_id)
+
+    def sync(self) -> int:
+        """
+        Apply vectors other processes stored since the last sync
+
+        Events only reach the process that published them, so users ingested
+        by another worker are found in the shared feature store instead. They
+        are added to the LSH index, their own cached list is dropped and the
+        lists of others are patched, as refresh_user would. The first sync,
+        and the first after a compaction, only fill the LSH index: which users
+        changed since the precomputed lists were generated is unknown then.
+
+        Returns:
+            Number of users applied
+        """
+        with self._lock:
+            cursor = self._cursor
+        self._cursor, changed = self.index.changed_since(cursor)
+        with self._lock:
+            applied, self._applied = self._applied, {}
+        incremental = cursor is not None and cursor[:2] == self._cursor[:2]
+
+        count = 0
+        for user_id, row, features in changed:
+            if applied.get(user_id) == row:
+                continue
+            if self.lsh is not None:
+                self.lsh.update_user(user_id, features)
+            if incremental:
+                with self._lock:
+                    self._cache.delete(user_id)
+                self._patch_others(user_id)
+            count += 1
+        if self.lsh is not None:
+            # Saved with the index, so a reload resumes from here
+            self.lsh.cursor = self._cursor
+        return count
+
+    def _patch_others(self, user_id: str) -> int:
+        """Re-score a changed user in every other cached list"""
+        with self._lock:
+            self._changed_at[user_id] = time.time()
+            cached = [
+                (other, listed)
+                for other, listed in self._cache.items()
+                if other != user_id
+            ]
+        if not cached:
+            return 0
+
+        scores = self.index.score_users(user_id, [other for other, _ in cached])
+        changed = 0
+        with self._lock:
+            for (other, listed), score in zip(cached, scores.tolist()):
+                patched = self._patch(listed, user_id, score)
+                if patched is listed:
+                    continue
+                changed += 1
+                if patched is None:
+                    self._cache.delete(other)
+                else:
+                    self._cache.set(other, patched)
+        return changed
+
+    def _from_lists(self, user_id: str) -> Optional[list[tuple[str, float]]]:
+        """The user's precomputed list brought up to date, if there is one"""
+        with self._lock:
+            lists = self.lists
+            if lists is None or lists.k < self.k:
+                return None
+            changed = [
+                other
+                for other, changed_at in self._changed_at.items()
+                if changed_at >= lists.generated_at
+            ]
+        # The user's own vector changed, or patching would cost more than scoring
+        if user_id in changed or len(changed) > MATCH_PATCH_LIMIT:
+            return None
+        listed = lists.get(user_id, self.k)
+        if listed is None:
+            return None
+        if changed:
+            scores = self.index.score_users(user_id, changed)
+            for other, score in zip(changed, scores.tolist()):
+                listed = self._patch(listed, other, score)
+                if listed is None:
+                    return None
+        with self._lock:
+            self._cache.set(user_id, listed)
+        return listed
+
+    def _patch(
+        self, listed: list[tuple[str, float]], user_id: str, score: float
+    ) -> Optional[list[tuple[str, float]]]:
+        """A list with user_id re-scored; the same list if unaffected, None if lost"""
+        kept = [match for match in listed if match[0] != user_id]
+        was_listed = len(kept) != len(listed)
+        if score > 0 and (len(kept) < self.k or score > kept[-1][1]):
+            kept.append((user_id, score))
+            kept.sort(key=lambda match: match[1], reverse=True)
+            return kept[: self.k]
+        if not was_listed:
+            return listed
+        return None if len(listed) >= self.k else kept
+
+
+def load_from_storage(
+    storage_service,
+    indexes: Iterable,
+    workers: int = MATCH_LOAD_WORKERS,
+    catalog: Optional[CatalogStore] = None,
+) -> int:
+    """
+    Fill indexes from every user's top artists/tracks snapshots in the bucket
+
+    Args:
+        storage_service: StorageService to read snapshots with
+        indexes: Objects with an update_user(user_id, features) method, e.g.
+            MatchIndex and LSHIndex
+        workers: Snapshots downloaded concurrently
+        catalog: CatalogStore resolving ranked ID lists; its cache is shared
+            across users, so each artist or track is downloaded once
+
+    Returns:
+        Number of users loaded
+    """
+    indexes = list(indexes)
+    catalog = catalog or CatalogStore(storage_service)
+    snapshots_by_user: dict[str, list] = {}
+    for blob in storage_service.bucket.list_blobs():
+        if blob.name.startswith(COMPACTED_PREFIX):
+            continue
+        parsed = parse_snapshot_name(blob.name)
+        if parsed is not None:
+            user_id, kind, time_range = parsed
+            snapshots_by_user.setdefault(user_id, []).append((kind, time_range, blob))
+
+    def load_user(item: tuple[str, list]) -> None:
+        user_id, blobs = item
+        snapshots = [
+            (
+                (kind, time_range),
+                storage_service.download_blob_json(blob),
+            )
+            for kind, time_range, blob in blobs
+        ]
+        # Ranked ID lists refer to artist and track objects in the catalog
+        snapshots = [(key, catalog.resolve(data)) for key, data in snapshots]
+        features = user_features(snapshots)
+        for index in indexes:
+            index.update_user(user_id, features)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(load_user, snapshots_by_user.items()):
+            pass
+
+    logger.info(f"Loaded taste vectors for {len(snapshots_by_user)} users")
+    return len(snapshots_by_user)
@@ -0,0 +1,291 @@
+"""Batch precomputation of every user's top matches into memory-mapped lists"""
+
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from app.services.feature_store import FEATURE_STORE_DIR, FeatureStore
+
+logger = logging.getLogger(__name__)
+
+MATCH_LISTS_DIR = os.getenv("MATCH_LISTS_DIR", "match_lists")
+
+# Matches stored per user; at least MATCH_CACHE_K for the API to use the lists
+PRECOMPUTE_K = int(os.getenv("PRECOMPUTE_K", "50"))
+PRECOMPUTE_WORKERS = int(os.getenv("PRECOMPUTE_WORKERS", str(os.cpu_count() or 1)))
+
+# Users scored per matrix product; each block holds a dense block x users array
+PRECOMPUTE_BLOCK_ROWS = int(os.getenv("PRECOMPUTE_BLOCK_ROWS", "256"))
+
+# Seconds between in-app runs; 0 leaves scheduling to cron and the script
+PRECOMPUTE_INTERVAL = float(os.getenv("PRECOMPUTE_INTERVAL", "0"))
+
+NEIGHBOR_DTYPE = np.dtype("<i4")
+SCORE_DTYPE = np.dtype("<f4")
+
+
+def _generation_dir(directory: str, generation: int) -> str:
+    return os.path.join(directory, f"g{generation}")
+
+
+def _read_meta(directory: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(directory, "meta.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class MatchLists:
+    """
+    Precomputed top matches of every user, read-only and memory-mapped
+
+    Row i of neighbors.bin and scores.bin holds the k best matches of the i-th
+    user in users.txt, best first, as positions in users.txt and cosine
+    similarities; unused slots are -1. A lookup is a dict lookup plus a slice.
+    """
+
+    def __init__(self, directory: str, meta: dict):
+        self.k = meta["k"]
+        self.generated_at = meta["generated_at"]
+        path = _generation_dir(directory, meta["generation"])
+        with open(os.path.join(path, "users.txt")) as f:
+            self.user_ids = f.read().splitlines()
+        self._positions = {user_id: i for i, user_id in enumerate(self.user_ids)}
+        shape = (len(self.user_ids), self.k)
+        if self.k and self.user_ids:
+            self._neighbors = np.memmap(
+                os.path.join(path, "neighbors.bin"), NEIGHBOR_DTYPE, "r", shape=shape
+            )
+            self._scores = np.memmap(
+                os.path.join(path, "scores.bin"), SCORE_DTYPE, "r", shape=shape
+            )
+        else:
+            self._neighbors = np.zeros(shape, dtype=NEIGHBOR_DTYPE)
+            self._scores = np.zeros(shape, dtype=SCORE_DTYPE)
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    @classmethod
+    def load(cls, directory: str = MATCH_LISTS_DIR) -> Optional["MatchLists"]:
+        """The latest lists in directory, or None if none were written"""
+        meta = _read_meta(directory)
+        if meta is None:
+            return None
+        return cls(directory, meta)
+
+    def get(self, user_id: str, k: Optional[int] = None) -> Optional[list]:
+        """
+        A user's top k matches as (user_id, score), or None if not precomputed
+        """
+        position = self._positions.get(user_id)
+        if position is None:
+            return None
+        neighbors = self._neighbors[position, :k].tolist()
+        scores = self._scores[position, :k].tolist()
+        return [
+            (self.user_ids[neighbor], score)
+            for neighbor, score in zip(neighbors, scores)
+            if neighbor >= 0
+        ]
+
+
+def _compute_shard(
+    store_dir: str,
+    store_generation: int,
+    output_dir: str,
+    k: int,
+    start: int,
+    stop: int,
+    block_rows: int,
+) -> dict:
+    """
+    Worker: write the top k matches of users start..stop into the output files
+
+    Each block of users is scored against everyone in one sparse matrix
+    product, and the k best of each row are picked with argpartition.
+    """
+    started = time.perf_counter()
+    store = FeatureStore(store_dir)
+    try:
+        snapshot = store.snapshot()
+        matrix = snapshot.matrix
+        if snapshot.generation != store_generation:
+            raise RuntimeError("Feature store was compacted during the run")
+        rows = np.load(os.path.join(output_dir, "rows.npy"))
+        users = matrix[rows]
+        users_t = users.T.tocsr()
+        shape = (len(rows), k)
+        neighbors = np.memmap(
+            os.path.join(output_dir, "neighbors.bin"), NEIGHBOR_DTYPE, "r+", shape=shape
+        )
+        scores = np.memmap(
+            os.path.join(output_dir, "scores.bin"), SCORE_DTYPE, "r+", shape=shape
+        )
+
+        for block_start in range(start, stop, block_rows):
+            block_stop = min(block_start + block_rows, stop)
+            block = (users[block_start:block_stop] @ users_t).toarray()
+            # Nobody matches themselves
+            block[
+                np.arange(block_stop - block_start), np.arange(block_start, block_stop)
+            ] = -np.inf
+            best = np.argpartition(block, -k, axis=1)[:, -k:]
+            best_scores = np.take_along_axis(block, best, axis=1)
+            order = np.argsort(-best_scores, axis=1)
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+            matched = best_scores > 0
+            neighbors[block_start:block_stop] = np.where(matched, best, -1)
+            scores[block_start:block_stop] = np.where(matched, best_scores, 0)
+
+        neighbors.flush()
+        scores.flush()
+    finally:
+        store.close()
+    return {
+        "pid": os.getpid(),
+        "users": stop - start,
+        "seconds": time.perf_counter() - started,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def precompute_matches(
+    store_dir: str = FEATURE_STORE_DIR,
+    output_dir: str = MATCH_LISTS_DIR,
+    k: int = PRECOMPUTE_K,
+    workers: int = PRECOMPUTE_WORKERS,
+    block_rows: int = PRECOMPUTE_BLOCK_ROWS,
+) -> dict:
+    """
+    Compute every user's top k matches across a process pool
+
+    Users are cut into shards, several per worker so they finish evenly.
+    Workers map the feature store themselves and write their rows straight
+    into the shared output files. The lists are written to a new generation
+    directory and published by replacing meta.json, so readers never see a
+    half-written run.
+
+    Returns:
+        Summary with users, k, seconds, users_per_second, and per worker
+        process the users scored, users_per_second and peak_rss_mib
+
+    Raises:
+        RuntimeError: If another run holds the lock or the feature store was
+            compacted while the job ran
+    """
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    lock_file = open(os.path.join(output_dir, ".lock"), "a+")
+    try:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError("Another precompute run is in progress")
+
+        # Every worker scores the same users: those live in this snapshot
+        generated_at = time.time()
+        store = FeatureStore(store_dir)
+        try:
+            snapshot = store.snapshot()
+            store_generation = snapshot.generation
+            rows = snapshot.latest[snapshot.latest >= 0]
+            user_ids = [snapshot.user_ids[u] for u in snapshot.row_users[rows].tolist()]
+        finally:
+            store.close()
+        k = max(0, min(k, len(rows) - 1))
+
+        previous = _read_meta(output_dir)
+        generation = previous["generation"] + 1 if previous else 0
+        path = _generation_dir(output_dir, generation)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        with open(os.path.join(path, "users.txt"), "w") as f:
+            f.write("".join(f"{user_id}\n" for user_id in user_ids))
+        np.save(os.path.join(path, "rows.npy"), rows)
+        for name, dtype in (
+            ("neighbors.bin", NEIGHBOR_DTYPE),
+            ("scores.bin", SCORE_DTYPE),
+        ):
+            with open(os.path.join(path, name), "wb") as f:
+                f.truncate(len(rows) * k * dtype.itemsize)
+
+        per_worker: dict[int, dict] = {}
+        if k:
+            shard_size = max(block_rows, -(-len(rows) // (workers * 4)))
+            # Spawned, not forked: the app may run this from a threaded process
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        _compute_shard,
+                        store_dir,
+                        store_generation,
+                        path,
+                        k,
+                        start,
+                        min(start + shard_size, len(rows)),
+                        block_rows,
+                    )
+                    for start in range(0, len(rows), shard_size)
+                ]
+                for future in futures:
+                    result = future.result()
+                    worker = per_worker.setdefault(
+                        result["pid"], {"users": 0, "seconds": 0.0, "peak_rss_kib": 0}
+                    )
+                    worker["users"] += result["users"]
+                    worker["seconds"] += result["seconds"]
+                    worker["peak_rss_kib"] = max(
+                        worker["peak_rss_kib"], result["peak_rss_kib"]
+                    )
+
+        meta_path = os.path.join(output_dir, "meta.json")
+        with open(f"{meta_path}.tmp", "w") as f:
+            json.dump(
+                {"generation": generation, "k": k, "generated_at": generated_at}, f
+            )
+        os.replace(f"{meta_path}.tmp", meta_path)
+        if previous:
+            # Readers still mapping the old files keep them until they reload
+            shutil.rmtree(
+                _generation_dir(output_dir, previous["generation"]), ignore_errors=True
+            )
+    finally:
+        lock_file.close()
+
+    seconds = time.perf_counter() - started
+    summary = {
+        "users": len(rows),
+        "k": k,
+        "seconds": seconds,
+        "users_per_second": len(rows) / seconds if seconds else 0.0,
+        "workers": {
+            pid: {
+                "users": worker["users"],
+                "users_per_second": worker["users"] / worker["seconds"]
+                if worker["seconds"]
+                else 0.0,
+                "peak_rss_mib": worker["peak_rss_kib"] / 1024,
+            }
+            for pid, worker in per_worker.items()
+        },
+    }
+    logger.info(
+        f"Precomputed top {k} matches for {summary['users']} users in "
+        f"{seconds:.1f}s ({summary['users_per_second']:.0f} users/s)"
+    )
+    return summary
@@ -0,0 +1,117 @@
+"""Slim response shapes for the /api/data/* endpoints"""
+
+from typing import Callable, Optional
+
+# Images at least this wide are preferred; smaller ones look blurry on the dashboard
+MIN_IMAGE_WIDTH = 160
+
+
+def pick_image(
+    images: Optional[list], min_width: int = MIN_IMAGE_WIDTH
+) -> Optional[str]:
+    """
+    Return the URL of the smallest image at least min_width wide
+
+    Falls back to the largest image when none is wide enough, or None if there
+    are no images.
+    """
+    if not images:
+        return None
+    sized = sorted(images, key=lambda image: image.get("width") or 0)
+    for image in sized:
+        if (image.get("width") or 0) >= min_width:
+            return image["url"]
+    return sized[-1]["url"]
+
+
+def compact_artist(artist: dict) -> dict:
+    """Artist reduced to what the dashboard displays"""
+    return {
+        "id": artist.get("id"),
+        "name": artist.get("name"),
+        "image": pick_image(artist.get("images")),
+        "genres": artist.get("genres", [])[:3],
+        "popularity": artist.get("popularity"),
+    }
+
+
+def compact_track(track: dict) -> dict:
+    """Track reduced to its name, artists, album and artwork"""
+    album = track.get("album") or {}
+    return {
+        "id": track.get("id"),
+        "name": track.get("name"),
+        "artists": [artist.get("name") for artist in track.get("artists", [])],
+        "album": album.get("name"),
+        "image": pick_image(album.get("images")),
+        "duration_ms": track.get("duration_ms"),
+        "popularity": track.get("popularity"),
+    }
+
+
+def compact_playlist(playlist: dict) -> dict:
+    """Playlist reduced to its name, owner, artwork and track count"""
+    return {
+        "id": playlist.get("id"),
+        "name": playlist.get("name"),
+        "owner": (playlist.get("owner") or {}).get("display_name"),
+        "image": pick_image(playlist.get("images")),
+        "tracks": (playlist.get("tracks") or {}).get("total"),
+    }
+
+
+def select_fields(item: dict, fields: list[str]) -> dict:
+    """
+    Keep only the requested keys; dotted names reach into nested objects
+
+    Subfields of the same key are kept together, e.g. 'images.url' and
+    'images.width' both survive; a bare key keeps its whole value.
+    """
+    # key -> its requested subfields, or None for the whole value
+    wanted: dict[str, Optional[list[str]]] = {}
+    for field in fields:
+        head, _, rest = field.partition(".")
+        if not rest:
+            wanted[head] = None
+        elif wanted.get(head, []) is not None:
+            wanted.setdefault(head, []).append(rest)
+
+    result = {}
+    for head, rests in wanted.items():
+        if head not in item:
+            continue
+        value = item[head]
+        if rests and isinstance(value, dict):
+            result[head] = select_fields(value, rests)
+        elif rests and isinstance(value, list):
+            result[head] = [
+                select_fields(element, rests) if isinstance(element, dict) else element
+                for element in value
+            ]
+        else:
+            result[head] = value
+    return result
+
+
+def project_page(
+    page: dict, compact: Callable[[dict], dict], fields: Optional[str] = None
+) -> dict:
+    """
+    Shape a Spotify paging object for the client
+
+    Args:
+        page: Spotify paging object with an 'items' list
+        compact: Function producing the default compact shape of one item
+        fields: None for the compact shape, '*' for the raw Spotify items, or a
+            comma-separated list of (optionally dotted) raw fields to keep
+
+    Returns:
+        Dict with 'items' and 'total'
+    """
+    items = page.get("items", [])
+    if fields is None:
+        items = [compact(item) for item in items]
+    elif fields != "*":
+        wanted = [field.strip() for field in fields.split(",") if field.strip()]
+        items = [select_fields(item, wanted) for item in items]
+    return {"items": items, "total": page.get("total", len(items))}
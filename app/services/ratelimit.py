@@ -0,0 +1,124 @@
+"""App-wide rate limiting for outbound Spotify API calls"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from enum import IntEnum
+from typing import Optional
+
+
+class Priority(IntEnum):
+    """Scheduling class of a request; lower values are served first"""
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class Ticket:
+    """
+    One request's place in the RateLimiter queue
+
+    Requests shared by several callers hold a ticket, so a more urgent caller
+    joining one can move it up with RateLimiter.promote().
+    """
+
+    def __init__(self, priority: Priority = Priority.INTERACTIVE):
+        self.priority = priority
+        # Set while the request waits for a token
+        self.future: Optional[asyncio.Future] = None
+
+
+class RateLimiter:
+    """
+    Token bucket scheduler shared by all outbound Spotify calls
+
+    Waiting requests are released in priority order, so interactive dashboard
+    calls go ahead of background ingest work. When Spotify answers with a 429,
+    pause() stops releasing requests until the Retry-After period has passed.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Args:
+            rate: Sustained requests per second allowed by the app quota
+            burst: Maximum number of requests that may be sent back to back
+        """
+        self.rate = rate
+        self.capacity = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of requests waiting for a token"""
+        return len({id(future) for _, _, future in self._waiters if not future.done()})
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    async def acquire(self, priority: Priority | Ticket = Priority.INTERACTIVE) -> None:
+        """Wait until a request of the given priority, or holding ticket, may be sent"""
+        ticket = priority if isinstance(priority, Ticket) else Ticket(priority)
+        self._refill()
+        if (
+            not self._waiters
+            and self._tokens >= 1
+            and time.monotonic() >= self._blocked_until
+        ):
+            self._tokens -= 1
+            return
+
+        ticket.future = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._waiters, (ticket.priority, next(self._counter), ticket.future)
+        )
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await ticket.future
+        finally:
+            ticket.future = None
+
+    def promote(self, ticket: Ticket, priority: Priority) -> None:
+        """Raise a ticket to priority, moving it up the queue if it is waiting"""
+        if priority >= ticket.priority:
+            return
+        ticket.priority = priority
+        if ticket.future is not None and not ticket.future.done():
+            # The old entry stays in the heap and is skipped once the future is done
+            heapq.heappush(
+                self._waiters, (priority, next(self._counter), ticket.future)
+            )
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every request for the given number of seconds"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    async def _dispatch(self) -> None:
+        """Hand out tokens to waiters, highest priority first"""
+        while self._waiters:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Caller was cancelled while waiting, or promoted and served
+                continue
+            self._tokens -= 1
+            future.set_result(None)
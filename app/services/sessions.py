@@ -0,0 +1,181 @@
+"""Expiring session stores shared by the auth routes"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "100000"))
+
+
+class SessionStore(ABC):
+    """
+    Interface for a key-value store whose entries expire after a TTL
+
+    Methods may block on I/O; call them from async code with asyncio.to_thread.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        """Return the value stored under key, or None if missing or expired"""
+
+    @abstractmethod
+    def set(self, key: str, value: dict, ttl: float) -> None:
+        """Store value under key for ttl seconds"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove key if present"""
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process store bounded to maxsize entries
+
+    Expired entries are swept every sweep_interval seconds, and once the store is
+    full the least recently used entry is evicted. Only visible to the current
+    worker process.
+    """
+
+    def __init__(self, maxsize: int = SESSION_MAX_ENTRIES, sweep_interval: float = 60):
+        self.maxsize = maxsize
+        self.sweep_interval = sweep_interval
+        self._data: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict, ttl: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sweep >= self.sweep_interval:
+                self._sweep(now)
+            self._data[key] = (now + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _sweep(self, now: float) -> None:
+        expired = [
+            key for key, (expires_at, _) in self._data.items() if expires_at <= now
+        ]
+        for key in expired:
+            del self._data[key]
+        self._last_sweep = now
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Store backed by a SQLite file, shared by every worker process on the host
+
+    Point all uvicorn workers (or instances mounting the same volume) at the same
+    path to share sessions without sticky routing.
+    """
+
+    def __init__(
+        self,
+        path: str = SESSION_DB_PATH,
+        table: str = "sessions",
+        sweep_interval: float = 60,
+    ):
+        """
+        Args:
+            path: SQLite database file
+            table: Table holding this store's entries, so several stores can share a file
+            sweep_interval: Seconds between purges of expired rows
+        """
+        self.table = table
+        self.sweep_interval = sweep_interval
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)"
+        )
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: dict, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep >= self.sweep_interval:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE expires_at <= ?", (now,)
+                )
+                self._last_sweep = now
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), now + ttl),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+
+def create_session_store(
+    backend: str = SESSION_BACKEND,
+    table: str = "sessions",
+    path: str = SESSION_DB_PATH,
+) -> SessionStore:
+    """
+    Build the session store selected by SESSION_BACKEND
+
+    Args:
+        backend: 'memory' for a per-process store, 'sqlite' for a shared one
+        table: SQLite table name, so several stores can share a file
+        path: SQLite database file
+
+    Raises:
+        ValueError: If the backend is unknown
+    """
+    if backend == "memory":
+        return MemorySessionStore()
+    if backend == "sqlite":
+        return SQLiteSessionStore(path, table=table)
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
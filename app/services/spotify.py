@@ -1,52 +1,699 @@
 """Spotify API service for fetching user data"""
 
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Optional
+
 import httpx
 
+from app.services.ratelimit import Priority, RateLimiter, Ticket
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings for the shared client
+SPOTIFY_MAX_CONNECTIONS = int(os.getenv("SPOTIFY_MAX_CONNECTIONS", "100"))
+SPOTIFY_MAX_KEEPALIVE = int(os.getenv("SPOTIFY_MAX_KEEPALIVE", "20"))
+SPOTIFY_KEEPALIVE_EXPIRY = float(os.getenv("SPOTIFY_KEEPALIVE_EXPIRY", "30"))
+SPOTIFY_TIMEOUT = float(os.getenv("SPOTIFY_TIMEOUT", "10"))
+SPOTIFY_CONNECT_TIMEOUT = float(os.getenv("SPOTIFY_CONNECT_TIMEOUT", "5"))
+SPOTIFY_HTTP2 = os.getenv("SPOTIFY_HTTP2", "false").lower() == "true"
+
+# Outbound request quota of the whole deployment. Each process keeps its own
+# bucket, so the quota is split evenly across SPOTIFY_WORKERS processes; count
+# every worker of every instance calling Spotify with the same app credentials.
+# Defaults to WEB_CONCURRENCY, which uvicorn also reads for --workers.
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", "10"))
+SPOTIFY_RATE_BURST = int(os.getenv("SPOTIFY_RATE_BURST", "20"))
+SPOTIFY_WORKERS = int(os.getenv("SPOTIFY_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+SPOTIFY_MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", "3"))
+
+# Library pagination: items per page and pages fetched at once per user
+SPOTIFY_PAGE_SIZE = 50
+SPOTIFY_PAGE_CONCURRENCY = int(os.getenv("SPOTIFY_PAGE_CONCURRENCY", "4"))
+
+# Partial-response filter for playlist items; drops markets, images and links
+PLAYLIST_ITEM_FIELDS = (
+    "total,items(added_at,track(id,name,uri,duration_ms,popularity,"
+    "artists(id,name),album(id,name,release_date)))"
+)
+
+# Multi-ID endpoints accept at most this many IDs per request
+ARTISTS_BATCH_SIZE = 50
+AUDIO_FEATURES_BATCH_SIZE = 100
+
+# How long enrichment waits for other ingests' IDs before sending a batch
+SPOTIFY_ENRICH_DELAY = float(os.getenv("SPOTIFY_ENRICH_DELAY", "0.2"))
+
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+# Shared client, opened by the app lifespan (see app.main.lifespan)
+_client: Optional[httpx.AsyncClient] = None
+
+rate_limiter = RateLimiter(
+    rate=SPOTIFY_RATE_LIMIT / SPOTIFY_WORKERS,
+    burst=max(1, SPOTIFY_RATE_BURST // SPOTIFY_WORKERS),
+)
+
+# Upstream requests currently in flight and their rate limiter tickets, keyed
+# by (token, path, params)
+_inflight: dict[tuple, tuple[asyncio.Task, Ticket]] = {}
+
+
+class SpotifyRateLimitError(Exception):
+    """Raised when Spotify keeps answering 429 after all retries"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Spotify rate limit exceeded, retry after {retry_after:g}s")
+        self.retry_after = retry_after
+
+
+def create_client() -> httpx.AsyncClient:
+    """Build a pooled HTTP client configured from the environment"""
+    http2 = SPOTIFY_HTTP2
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("SPOTIFY_HTTP2 is set but 'h2' is not installed, using HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=SPOTIFY_MAX_CONNECTIONS,
+            max_keepalive_connections=SPOTIFY_MAX_KEEPALIVE,
+            keepalive_expiry=SPOTIFY_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(SPOTIFY_TIMEOUT, connect=SPOTIFY_CONNECT_TIMEOUT),
+    )
+
+
+def init_client(client: Optional[httpx.AsyncClient] = None) -> httpx.AsyncClient:
+    """
+    Install the shared client used by every Spotify call
+
+    Args:
+        client: Pre-built client to inject, or None to build one from the environment
+
+    Returns:
+        The installed client
+    """
+    global _client
+    _client = client or create_client()
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared client and release its pooled connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client, creating it if the lifespan hook has not run"""
+    if _client is None:
+        return init_client()
+    return _client
+
+
+async def _request_token(data: dict) -> dict:
+    """POST to Spotify's accounts token endpoint"""
+    response = await get_client().post(
+        SPOTIFY_TOKEN_URL,
+        data=data,
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def exchange_code(
+    code: str, redirect_uri: str, client_id: str, client_secret: str
+) -> dict:
+    """Exchange an authorization code for access and refresh tokens"""
+    return await _request_token(
+        {
+            "grant_type": "authorization_code",
+            "code": code,
+            "redirect_uri": redirect_uri,
+            "client_id": client_id,
+            "client_secret": client_secret,
+        }
+    )
+
+
+async def request_client_token(client_id: str, client_secret: str) -> dict:
+    """Get an app access token (client credentials flow), for non-user endpoints"""
+    return await _request_token(
+        {
+            "grant_type": "client_credentials",
+            "client_id": client_id,
+            "client_secret": client_secret,
+        }
+    )
+
+
+async def refresh_access_token(
+    refresh_token: str, client_id: str, client_secret: str
+) -> dict:
+    """Trade a refresh token for a new access token"""
+    return await _request_token(
+        {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": client_id,
+            "client_secret": client_secret,
+        }
+    )
+
+
+async def _fetch_json(
+    path: str, access_token: str, params: dict, priority: Priority | Ticket
+) -> dict:
+    """
+    Perform a GET against the Spotify Web API through the shared rate limiter
+
+    A 429 response pauses the limiter for the Retry-After period and the request
+    is retried, up to SPOTIFY_MAX_RETRIES times.
+
+    Raises:
+        SpotifyRateLimitError: If Spotify is still rate limiting after all retries
+        httpx.HTTPStatusError: For any other error response
+    """
+    for attempt in range(SPOTIFY_MAX_RETRIES + 1):
+        await rate_limiter.acquire(priority)
+        response = await get_client().get(
+            f"{SPOTIFY_API_URL}{path}",
+            headers={"Authorization": f"Bearer {access_token}"},
+            params=params,
+        )
+        if response.status_code != 429:
+            response.raise_for_status()
+            return response.json()
+
+        retry_after = float(response.headers.get("Retry-After", "1"))
+        rate_limiter.pause(retry_after)
+        if attempt < SPOTIFY_MAX_RETRIES:
+            logger.warning(
+                f"Spotify rate limited {path}, retrying in {retry_after:g}s "
+                f"(retry {attempt + 1}/{SPOTIFY_MAX_RETRIES})"
+            )
+    raise SpotifyRateLimitError(retry_after)
+
+
+async def _get_json(
+    path: str,
+    access_token: str,
+    params: dict,
+    priority: Priority = Priority.INTERACTIVE,
+) -> dict:
+    """
+    GET a Spotify endpoint, sharing the upstream call with identical concurrent requests
+
+    Callers asking for the same (token, path, params) while a request is in flight
+    await the same task instead of sending a duplicate; an interactive caller
+    joining a background request promotes it in the rate limiter queue. The
+    returned dict is shared between those callers and must not be mutated.
+    """
+    key = (access_token, path, tuple(sorted(params.items())))
+    inflight = _inflight.get(key)
+    if inflight is None:
+        ticket = Ticket(priority)
+        task = asyncio.ensure_future(_fetch_json(path, access_token, params, ticket))
+        _inflight[key] = (task, ticket)
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        task, ticket = inflight
+        rate_limiter.promote(ticket, priority)
+    # Shield so one cancelled caller does not cancel the request for the others
+    return await asyncio.shield(task)
+
+
+async def get_current_user(
+    access_token: str, priority: Priority = Priority.INTERACTIVE
+):
+    """Fetch the current user's profile from Spotify API"""
+    try:
+        return await _get_json("/me", access_token, {}, priority)
+    except SpotifyRateLimitError:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to fetch user profile: {str(e)}")
+
 
 async def get_top_artists(
-    access_token: str, time_range: str = "medium_term", limit: int = 50
+    access_token: str,
+    time_range: str = "medium_term",
+    limit: int = 50,
+    priority: Priority = Priority.INTERACTIVE,
 ):
     """Fetch user's top artists from Spotify API"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.spotify.com/v1/me/top/artists",
-                headers={"Authorization": f"Bearer {access_token}"},
-                params={"time_range": time_range, "limit": limit},
-            )
-            response.raise_for_status()
-            return response.json()
+        return await _get_json(
+            "/me/top/artists",
+            access_token,
+            {"time_range": time_range, "limit": limit},
+            priority,
+        )
+    except SpotifyRateLimitError:
+        raise
     except Exception as e:
         raise Exception(f"Failed to fetch top artists: {str(e)}")
 
 
 async def get_top_tracks(
-    access_token: str, time_range: str = "medium_term", limit: int = 50
+    access_token: str,
+    time_range: str = "medium_term",
+    limit: int = 50,
+    priority: Priority = Priority.INTERACTIVE,
 ):
     """Fetch user's top tracks from Spotify API"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.spotify.com/v1/me/top/tracks",
-                headers={"Authorization": f"Bearer {access_token}"},
-                params={"time_range": time_range, "limit": limit},
-            )
-            response.raise_for_status()
-            return response.json()
+        return await _get_json(
+            "/me/top/tracks",
+            access_token,
+            {"time_range": time_range, "limit": limit},
+            priority,
+        )
+    except SpotifyRateLimitError:
+        raise
     except Exception as e:
         raise Exception(f"Failed to fetch top tracks: {str(e)}")
 
 
-async def get_playlists(access_token: str, limit: int = 50):
+async def get_playlists(
+    access_token: str, limit: int = 50, priority: Priority = Priority.INTERACTIVE
+):
     """Fetch user's playlists from Spotify API"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.spotify.com/v1/me/playlists",
-                headers={"Authorization": f"Bearer {access_token}"},
-                params={"limit": limit},
-            )
-            response.raise_for_status()
-            return response.json()
+        return await _get_json(
+            "/me/playlists", access_token, {"limit": limit}, priority
+        )
+    except SpotifyRateLimitError:
+        raise
     except Exception as e:
         raise Exception(f"Failed to fetch playlists: {str(e)}")
+
+
+async def get_several_artists(
+    access_token: str,
+    artist_ids: list[str],
+    priority: Priority = Priority.BACKGROUND,
+):
+    """Fetch up to ARTISTS_BATCH_SIZE full artist objects in one request"""
+    try:
+        return await _get_json(
+            "/artists", access_token, {"ids": ",".join(artist_ids)}, priority
+        )
+    except SpotifyRateLimitError:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to fetch artists: {str(e)}")
+
+
+async def get_audio_features(
+    access_token: str,
+    track_ids: list[str],
+    priority: Priority = Priority.BACKGROUND,
+) -> Optional[dict]:
+    """
+    Fetch audio features of up to AUDIO_FEATURES_BATCH_SIZE tracks in one request
+
+    Returns:
+        The response, or None if the endpoint is closed to this app (Spotify
+        deprecated it and answers 403 for apps registered since)
+    """
+    try:
+        return await _get_json(
+            "/audio-features", access_token, {"ids": ",".join(track_ids)}, priority
+        )
+    except SpotifyRateLimitError:
+        raise
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 403:
+            return None
+        raise Exception(f"Failed to fetch audio features: {str(e)}")
+    except Exception as e:
+        raise Exception(f"Failed to fetch audio features: {str(e)}")
+
+
+# ==================== LIBRARY PAGINATION ====================
+
+
+async def iter_pages(
+    access_token: str,
+    path: str,
+    params: Optional[dict] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    priority: Priority = Priority.BACKGROUND,
+) -> AsyncIterator[dict]:
+    """
+    Yield every page of an offset-paginated Spotify endpoint
+
+    The first page is fetched alone to learn the total; the remaining offsets
+    are then fetched concurrently, at most SPOTIFY_PAGE_CONCURRENCY at a time
+    and further bounded by semaphore, which callers share across endpoints to
+    cap concurrency per user. Pages are yielded in completion order.
+    """
+    params = params or {}
+    semaphore = semaphore or asyncio.Semaphore(SPOTIFY_PAGE_CONCURRENCY)
+
+    async def fetch(offset: int) -> dict:
+        async with semaphore:
+            return await _get_json(
+                path,
+                access_token,
+                {**params, "limit": SPOTIFY_PAGE_SIZE, "offset": offset},
+                priority,
+            )
+
+    first = await fetch(0)
+    yield first
+
+    offsets = iter(range(SPOTIFY_PAGE_SIZE, first.get("total") or 0, SPOTIFY_PAGE_SIZE))
+    pending: set[asyncio.Task] = set()
+    try:
+        while True:
+            for offset in offsets:
+                pending.add(asyncio.ensure_future(fetch(offset)))
+                if len(pending) >= SPOTIFY_PAGE_CONCURRENCY:
+                    break
+            if not pending:
+                break
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def iter_items(
+    access_token: str,
+    path: str,
+    params: Optional[dict] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> AsyncIterator[dict]:
+    """Yield every item of an offset-paginated Spotify endpoint"""
+    async for page in iter_pages(access_token, path, params, semaphore):
+        for item in page.get("items", []):
+            yield item
+
+
+async def iter_followed_artists(
+    access_token: str, semaphore: Optional[asyncio.Semaphore] = None
+) -> AsyncIterator[dict]:
+    """
+    Yield every artist the user follows
+
+    /me/following only supports cursor pagination, so its pages are fetched
+    one after another.
+    """
+    semaphore = semaphore or asyncio.Semaphore(1)
+    params = {"type": "artist", "limit": SPOTIFY_PAGE_SIZE}
+    while True:
+        async with semaphore:
+            page = await _get_json(
+                "/me/following", access_token, params, Priority.BACKGROUND
+            )
+        artists = page.get("artists", {})
+        for item in artists.get("items", []):
+            yield item
+        after = (artists.get("cursors") or {}).get("after")
+        if not artists.get("next") or not after:
+            break
+        params = {**params, "after": after}
+
+
+async def iter_playlist_tracks(
+    access_token: str, semaphore: Optional[asyncio.Semaphore] = None
+) -> AsyncIterator[dict]:
+    """
+    Yield the items of every playlist in the user's library
+
+    Each item is tagged with 'playlist_id'. Playlists are paged concurrently,
+    bounded by semaphore, and only the fields in PLAYLIST_ITEM_FIELDS are
+    requested from Spotify. Playlists Spotify refuses (403) or no longer has
+    (404) are skipped with a warning.
+    """
+    semaphore = semaphore or asyncio.Semaphore(SPOTIFY_PAGE_CONCURRENCY)
+    playlists = [
+        playlist
+        async for playlist in iter_items(
+            access_token, "/me/playlists", semaphore=semaphore
+        )
+    ]
+
+    # Merge the per-playlist generators through a bounded queue
+    queue: asyncio.Queue = asyncio.Queue(maxsize=SPOTIFY_PAGE_SIZE * 4)
+    done = object()
+
+    async def produce(playlist_id: str) -> None:
+        try:
+            async for item in iter_items(
+                access_token,
+                f"/playlists/{playlist_id}/tracks",
+                {"fields": PLAYLIST_ITEM_FIELDS},
+                semaphore,
+            ):
+                await queue.put({"playlist_id": playlist_id, **item})
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code not in (403, 404):
+                raise
+            logger.warning(f"Skipped inaccessible playlist {playlist_id}: {e}")
+
+    async def produce_all() -> None:
+        try:
+            await asyncio.gather(*(produce(p["id"]) for p in playlists if p))
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(done)
+
+    producer = asyncio.ensure_future(produce_all())
+    try:
+        while (item := await queue.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
+
+
+LIBRARY_COLLECTIONS = [
+    "saved_tracks",
+    "saved_albums",
+    "followed_artists",
+    "playlist_tracks",
+]
+
+
+def iter_library(
+    collection: str,
+    access_token: str,
+    semaphore: Optional[asyncio.Semaphore] = None,
+) -> AsyncIterator[dict]:
+    """
+    Yield every item of one of the LIBRARY_COLLECTIONS
+
+    Raises:
+        ValueError: If the collection is unknown
+    """
+    if collection == "saved_tracks":
+        return iter_items(access_token, "/me/tracks", semaphore=semaphore)
+    if collection == "saved_albums":
+        return iter_items(access_token, "/me/albums", semaphore=semaphore)
+    if collection == "followed_artists":
+        return iter_followed_artists(access_token, semaphore)
+    if collection == "playlist_tracks":
+        return iter_playlist_tracks(access_token, semaphore)
+    raise ValueError(f"Unknown library collection: {collection}")
+
+
+# ==================== CATALOG ENRICHMENT ====================
+
+
+class IdBatcher:
+    """
+    Coalesces concurrent lookups of IDs into multi-ID requests
+
+    IDs requested by any caller within delay seconds of each other are sent
+    together in batches of up to batch_size, and an ID already on its way is
+    not requested again; callers asking for it share the pending result.
+    """
+
+    def __init__(
+        self,
+        fetch_batch: Callable[[list[str]], Awaitable[dict[str, dict]]],
+        batch_size: int,
+        delay: float = SPOTIFY_ENRICH_DELAY,
+    ):
+        """
+        Args:
+            fetch_batch: Coroutine returning the objects found for a batch of
+                IDs, keyed by ID
+            batch_size: Most IDs per fetch_batch call
+            delay: Seconds to wait for more IDs before sending
+        """
+        self.fetch_batch = fetch_batch
+        self.batch_size = batch_size
+        self.delay = delay
+        self._pending: dict[str, asyncio.Future] = {}
+        self._queue: list[str] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def get_many(self, ids: Iterable[str]) -> dict[str, dict]:
+        """Objects for the given IDs, keyed by ID; IDs Spotify doesn't know are left out"""
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for item_id in dict.fromkeys(ids):
+            future = self._pending.get(item_id)
+            if future is None:
+                future = loop.create_future()
+                self._pending[item_id] = future
+                self._queue.append(item_id)
+            futures[item_id] = future
+        if self._queue and (self._flusher is None or self._flusher.done()):
+            self._flusher = asyncio.create_task(self._flush())
+
+        # Shield so one cancelled caller does not cancel the lookup for the others
+        results = await asyncio.gather(*(asyncio.shield(f) for f in futures.values()))
+        return {
+            item_id: result
+            for item_id, result in zip(futures, results)
+            if result is not None
+        }
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(self.delay)
+        while self._queue:
+            batches = [
+                self._queue[i : i + self.batch_size]
+                for i in range(0, len(self._queue), self.batch_size)
+            ]
+            self._queue = []
+            await asyncio.gather(*(self._send(batch) for batch in batches))
+
+    async def _send(self, batch: list[str]) -> None:
+        try:
+            found = await self.fetch_batch(batch)
+        except Exception as e:
+            for item_id in batch:
+                future = self._pending.pop(item_id)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for item_id in batch:
+            future = self._pending.pop(item_id)
+            if not future.done():
+                future.set_result(found.get(item_id))
+
+
+class CatalogEnricher:
+    """
+    Fills the catalog with metadata the top lists don't carry
+
+    Tracks only hold simplified artist objects, without genres or popularity,
+    and nothing carries audio features. The enricher looks up which of these
+    the catalog is missing, fetches them from Spotify's multi-ID endpoints
+    with an app token and stores them back, so each ID is fetched once
+    however many users share it. Lookups from concurrent ingests are batched
+    together by IdBatcher.
+    """
+
+    def __init__(self, client_id: Optional[str], client_secret: Optional[str]):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.audio_features_available = True
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+        self._artists = IdBatcher(self._fetch_artists, ARTISTS_BATCH_SIZE)
+        self._audio_features = IdBatcher(
+            self._fetch_audio_features, AUDIO_FEATURES_BATCH_SIZE
+        )
+
+    async def _app_token(self) -> str:
+        """Client credentials token, renewed a minute before it expires"""
+        async with self._token_lock:
+            if self._token is None or time.monotonic() >= self._token_expires_at:
+                data = await request_client_token(self.client_id, self.client_secret)
+                self._token = data["access_token"]
+                self._token_expires_at = (
+                    time.monotonic() + data.get("expires_in", 3600) - 60
+                )
+            return self._token
+
+    async def _fetch_artists(self, artist_ids: list[str]) -> dict[str, dict]:
+        data = await get_several_artists(await self._app_token(), artist_ids)
+        return {artist["id"]: artist for artist in data.get("artists") or [] if artist}
+
+    async def _fetch_audio_features(self, track_ids: list[str]) -> dict[str, dict]:
+        data = await get_audio_features(await self._app_token(), track_ids)
+        if data is None:
+            if self.audio_features_available:
+                logger.warning(
+                    "Spotify refused /audio-features (403); skipping audio features"
+                )
+            self.audio_features_available = False
+            return {}
+        return {
+            features["id"]: features
+            for features in data.get("audio_features") or []
+            if features
+        }
+
+    async def enrich(
+        self, catalog, artist_ids: Iterable[str], track_ids: Iterable[str]
+    ) -> dict:
+        """
+        Fetch and store the artists and audio features the catalog lacks
+
+        Args:
+            catalog: CatalogStore to look up and store objects in
+            artist_ids: Artists that should have full objects
+            track_ids: Tracks that should have audio features
+
+        Returns:
+            Number of artists and audio features fetched from Spotify
+
+        Raises:
+            SpotifyRateLimitError: If Spotify keeps rate limiting
+            Exception: If a request or catalog operation fails
+        """
+        artist_ids = list(dict.fromkeys(artist_ids))
+        track_ids = list(dict.fromkeys(track_ids))
+        if not self.audio_features_available:
+            track_ids = []
+
+        known_artists, known_features = await asyncio.gather(
+            asyncio.to_thread(catalog.get, "artists", artist_ids),
+            asyncio.to_thread(catalog.get, "audio_features", track_ids),
+        )
+        # IDs Spotify returned null for last time are not asked for again
+        absent_artists = catalog.missing("artists", artist_ids)
+        absent_features = catalog.missing("audio_features", track_ids)
+        wanted_artists = [
+            i for i in artist_ids if i not in known_artists and i not in absent_artists
+        ]
+        wanted_tracks = [
+            i for i in track_ids if i not in known_features and i not in absent_features
+        ]
+        artists, features = await asyncio.gather(
+            self._artists.get_many(wanted_artists),
+            self._audio_features.get_many(wanted_tracks),
+        )
+        catalog.mark_missing("artists", set(wanted_artists) - artists.keys())
+        if self.audio_features_available:
+            # A refused request returns nothing, which says nothing about the IDs
+            catalog.mark_missing("audio_features", set(wanted_tracks) - features.keys())
+        await asyncio.gather(
+            asyncio.to_thread(catalog.put, "artists", artists.values()),
+            asyncio.to_thread(catalog.put, "audio_features", features.values()),
+        )
+        return {"artists": len(artists), "audio_features": len(features)}
@@ -1,26 +1,82 @@
 """Google Cloud Storage service for data persistence"""
 
-import json
+import asyncio
+import gzip
+import logging
 import os
-from typing import Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Iterable, Iterator, Optional
 
 from dotenv import load_dotenv
 from google.api_core import client_options as client_options_lib
+from google.api_core.exceptions import PreconditionFailed
 from google.auth import default
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+from app.services.codec import (
+    GZIP_LEVEL,
+    decode_json,
+    encode_json_with_digest,
+    iter_ndjson,
+    ndjson_line,
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
 
+# Custom metadata key holding the SHA-256 of a snapshot's uncompressed JSON
+CONTENT_HASH_KEY = "content-sha256"
+
+# Attempts to win a write race before giving up
+MAX_WRITE_ATTEMPTS = 3
+
+# Size of the HTTP connection pool shared by concurrent uploads
+GCS_POOL_SIZE = int(os.getenv("GCS_POOL_SIZE", "32"))
+
+# Resumable upload chunk size (a multiple of 256 KiB); bounds memory per stream
+GCS_CHUNK_SIZE = int(os.getenv("GCS_CHUNK_SIZE", str(2 * 1024 * 1024)))
+
+# Records pulled from the event loop per hop when streaming an async source
+STREAM_BATCH_SIZE = 500
+
+# Seconds a streaming upload thread waits for a batch before checking for cancel
+STREAM_POLL_INTERVAL = 0.5
+
+# Streaming uploads hold a thread for their whole duration, so they get their
+# own pool instead of starving asyncio.to_thread callers
+GCS_STREAM_WORKERS = int(os.getenv("GCS_STREAM_WORKERS", "16"))
+_stream_executor = ThreadPoolExecutor(
+    max_workers=GCS_STREAM_WORKERS, thread_name_prefix="gcs-stream"
+)
+
 
 class StorageService:
-    """Service for uploading data to Google Cloud Storage"""
+    """
+    Service for uploading data to Google Cloud Storage
+
+    Use get_storage_service() to share one instance across the process. Its
+    authorized session keeps a pool of GCS_POOL_SIZE connections, so the
+    instance can be used from several upload threads at once.
+    """
 
     def __init__(self):
         """Initialize GCS client with default credentials"""
         credentials, _ = default()
 
+        # One authorized session whose connection pool is sized for concurrent uploads
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(
+            pool_connections=GCS_POOL_SIZE, pool_maxsize=GCS_POOL_SIZE
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
         # Check for emulator configuration for local development
         emulator_host = os.getenv("STORAGE_EMULATOR_HOST")
         if emulator_host:
@@ -28,10 +84,10 @@ class StorageService:
                 api_endpoint=emulator_host
             )
             self.client = storage.Client(
-                credentials=credentials, client_options=client_options
+                credentials=credentials, client_options=client_options, _http=session
             )
         else:
-            self.client = storage.Client(credentials=credentials)
+            self.client = storage.Client(credentials=credentials, _http=session)
 
         self.bucket_name = GCS_BUCKET_NAME
 
@@ -42,7 +98,14 @@ class StorageService:
 
     def upload_json(self, data: dict, blob_name: str) -> Optional[str]:
         """
-        Upload a dictionary as a JSON file to GCS bucket
+        Upload a dictionary as a compressed JSON file to GCS bucket
+
+        The blob is stored as gzip-compressed compact JSON with
+        Content-Encoding: gzip; see app.services.codec. The SHA-256 of the
+        JSON is kept in the blob's metadata, and the write is skipped when the
+        stored blob already has the same content. Writes are conditional on the
+        generation that was read, so two ingests racing on the same blob cannot
+        silently overwrite each other; the loser re-reads and tries again.
 
         Args:
             data: Dictionary to upload
@@ -56,15 +119,226 @@ class StorageService:
             Exception: If upload fails
         """
         try:
-            blob = self.bucket.blob(blob_name)
+            payload, digest = encode_json_with_digest(data)
 
-            # Convert dict to JSON and upload
-            json_data = json.dumps(data, indent=2)
-            blob.upload_from_string(
-                json_data,
-                content_type="application/json",
-            )
+            for _ in range(MAX_WRITE_ATTEMPTS):
+                existing = self.bucket.get_blob(blob_name)
+                if existing is not None and _same_content(existing, digest):
+                    logger.debug(f"Skipped unchanged {blob_name}")
+                    return existing.public_url
+
+                blob = self.bucket.blob(blob_name)
+                blob.content_encoding = "gzip"
+                blob.metadata = {CONTENT_HASH_KEY: digest}
+                try:
+                    blob.upload_from_string(
+                        payload,
+                        content_type="application/json",
+                        # 0 means the blob must not exist yet
+                        if_generation_match=existing.generation if existing else 0,
+                    )
+                except PreconditionFailed:
+                    logger.debug(f"Concurrent write to {blob_name}, retrying")
+                    continue
+                return blob.public_url
+
+            raise Exception(f"lost the write race {MAX_WRITE_ATTEMPTS} times")
+        except Exception as e:
+            raise Exception(f"Failed to upload {blob_name} to GCS: {str(e)}")
+
+    @staticmethod
+    def download_blob_json(blob: storage.Blob) -> Any:
+        """
+        Download and parse a JSON blob, compressed or not
+
+        Raises:
+            NotFound: If the blob does not exist
+        """
+        # Raw bytes skip decompressive transcoding; decode_json inflates them
+        return decode_json(blob.download_as_bytes(raw_download=True))
+
+    def download_json(self, blob_name: str) -> Optional[dict]:
+        """
+        Download and parse a JSON blob written by upload_json
+
+        Reads both compressed blobs and older plain JSON ones.
+
+        Args:
+            blob_name: Name of the blob in GCS
+
+        Returns:
+            Parsed JSON, or None if the blob does not exist
+
+        Raises:
+            Exception: If the download fails
+        """
+        try:
+            blob = self.bucket.get_blob(blob_name)
+            if blob is None:
+                return None
+            return self.download_blob_json(blob)
+        except Exception as e:
+            raise Exception(f"Failed to download {blob_name} from GCS: {str(e)}")
+
+    def upload_ndjson(self, records: Iterable[dict], blob_name: str) -> int:
+        """
+        Stream records to GCS as gzip-compressed NDJSON
+
+        Records are compressed as they arrive and sent in GCS_CHUNK_SIZE pieces
+        through a resumable upload, so memory use does not grow with the number
+        of records. Works against the emulator set by STORAGE_EMULATOR_HOST.
+
+        Args:
+            records: Records to write, one JSON line each
+            blob_name: Name of the blob in GCS (e.g., 'user_id/saved_tracks.ndjson')
+
+        Returns:
+            Number of records written
 
-            return blob.public_url
+        Raises:
+            Exception: If upload fails
+        """
+        try:
+            blob = self.bucket.blob(blob_name, chunk_size=GCS_CHUNK_SIZE)
+            blob.content_encoding = "gzip"
+            count = 0
+            with blob.open(
+                "wb", content_type="application/x-ndjson", ignore_flush=True
+            ) as writer:
+                with gzip.GzipFile(
+                    fileobj=writer, mode="wb", compresslevel=GZIP_LEVEL, mtime=0
+                ) as compressed:
+                    for record in records:
+                        compressed.write(ndjson_line(record))
+                        count += 1
+            return count
         except Exception as e:
             raise Exception(f"Failed to upload {blob_name} to GCS: {str(e)}")
+
+    async def stream_ndjson(self, records: AsyncIterator[dict], blob_name: str) -> int:
+        """
+        Upload records produced by an async iterator with upload_ndjson
+
+        The upload runs in a dedicated worker thread which pulls STREAM_BATCH_SIZE records
+        at a time from the event loop, so the producer never runs ahead of the
+        upload by more than one batch. Cancelling the call aborts the upload:
+        the thread stops pulling and the resumable upload is terminated, so no
+        truncated blob is committed.
+
+        Returns:
+            Number of records written
+        """
+        loop = asyncio.get_running_loop()
+        reader = _LoopReader(records, loop)
+        upload = loop.run_in_executor(
+            _stream_executor, self.upload_ndjson, reader, blob_name
+        )
+        try:
+            # Shielded so a cancelled caller still waits for the thread below
+            return await asyncio.shield(upload)
+        finally:
+            reader.stop.set()
+            await asyncio.gather(upload, return_exceptions=True)
+            await reader.wait_idle()
+            await records.aclose()
+
+    def iter_ndjson(self, blob_name: str) -> Iterator[dict]:
+        """
+        Read records from an NDJSON blob written by upload_ndjson, one at a time
+
+        Raises:
+            Exception: If the download fails
+        """
+        try:
+            blob = self.bucket.blob(blob_name)
+            with blob.open("rb", raw_download=True) as raw:
+                with gzip.GzipFile(fileobj=raw) as stream:
+                    yield from iter_ndjson(stream)
+        except Exception as e:
+            raise Exception(f"Failed to read {blob_name} from GCS: {str(e)}")
+
+
+def _same_content(blob: storage.Blob, digest: str) -> bool:
+    """
+    Whether a stored blob already holds this content
+
+    Blobs written before the hash was recorded are rewritten once: their
+    bytes (indented plain JSON, or full objects where the catalog now keeps
+    IDs) never match the current encoding anyway.
+    """
+    return (blob.metadata or {}).get(CONTENT_HASH_KEY) == digest
+
+
+class _LoopReader:
+    """
+    Iterate an async iterator from a worker thread, one batch per loop hop
+
+    Setting stop makes the thread raise instead of waiting for the next
+    batch, which aborts the upload consuming it. The event loop side then
+    calls wait_idle so the iterator can be closed safely.
+    """
+
+    def __init__(self, records: AsyncIterator[dict], loop: asyncio.AbstractEventLoop):
+        self.records = records
+        self.loop = loop
+        self.stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __iter__(self) -> Iterator[dict]:
+        while True:
+            future = asyncio.run_coroutine_threadsafe(self._next_batch(), self.loop)
+            while True:
+                if self.stop.is_set() or self.loop.is_closed():
+                    raise RuntimeError("stream was cancelled")
+                try:
+                    batch = future.result(timeout=STREAM_POLL_INTERVAL)
+                    break
+                except TimeoutError:
+                    continue
+            if not batch:
+                return
+            yield from batch
+
+    async def _next_batch(self) -> list[dict]:
+        if self.stop.is_set():
+            return []
+        self._task = asyncio.current_task()
+        batch = []
+        try:
+            while len(batch) < STREAM_BATCH_SIZE:
+                batch.append(await anext(self.records))
+        except StopAsyncIteration:
+            pass
+        finally:
+            self._task = None
+        return batch
+
+    async def wait_idle(self) -> None:
+        """Cancel and wait out a batch still being pulled for a stopped thread"""
+        task = self._task
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.wait([task])
+
+
+_storage_service: Optional[StorageService] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage_service() -> StorageService:
+    """Return the process-wide StorageService, creating it on first use"""
+    global _storage_service
+    if _storage_service is None:
+        with _storage_lock:
+            if _storage_service is None:
+                _storage_service = StorageService()
+    return _storage_service
+
+
+def close_storage_service() -> None:
+    """Close the shared StorageService's HTTP session, if one was created"""
+    global _storage_service
+    with _storage_lock:
+        if _storage_service is not None:
+            _storage_service.client.close()
+            _storage_service = None
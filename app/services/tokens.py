@@ -0,0 +1,132 @@
+"""Spotify OAuth token storage and refresh"""
+
+import asyncio
+import logging
+import time
+
+import httpx
+
+from app.services.sessions import SessionStore
+from app.services.spotify import refresh_access_token
+
+logger = logging.getLogger(__name__)
+
+# Refresh tokens this many seconds before Spotify says they expire
+TOKEN_REFRESH_MARGIN = 300
+
+
+class TokenError(Exception):
+    """Raised when no usable access token exists for a user"""
+
+
+class TokenRefreshUnavailable(Exception):
+    """Raised when Spotify's token endpoint could not refresh a token right now"""
+
+
+class TokenManager:
+    """
+    Keeps each user's access and refresh tokens and renews them before expiry
+
+    Concurrent requests for a token that needs refreshing share a single call
+    to Spotify's token endpoint.
+    """
+
+    def __init__(
+        self,
+        store: SessionStore,
+        client_id: str,
+        client_secret: str,
+        ttl: float,
+        refresh_margin: float = TOKEN_REFRESH_MARGIN,
+    ):
+        """
+        Args:
+            store: Store for token records, keyed by user_id
+            client_id: Spotify app client ID
+            client_secret: Spotify app client secret
+            ttl: Seconds a token record is kept without being refreshed
+            refresh_margin: Seconds before expiry at which a token is refreshed
+        """
+        self.store = store
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._refreshing: dict[str, asyncio.Task] = {}
+
+    def save(self, user_id: str, token_data: dict) -> str:
+        """
+        Store the tokens from a Spotify token response
+
+        Spotify may omit refresh_token when refreshing, in which case the
+        previous one is kept.
+
+        Returns:
+            The new access token
+        """
+        refresh_token = token_data.get("refresh_token")
+        if refresh_token is None:
+            previous = self.store.get(user_id) or {}
+            refresh_token = previous.get("refresh_token")
+
+        self.store.set(
+            user_id,
+            {
+                "access_token": token_data["access_token"],
+                "refresh_token": refresh_token,
+                "expires_at": time.time() + token_data.get("expires_in", 3600),
+            },
+            ttl=self.ttl,
+        )
+        return token_data["access_token"]
+
+    def forget(self, user_id: str) -> None:
+        """Drop the stored tokens for user_id"""
+        self.store.delete(user_id)
+
+    async def get_access_token(self, user_id: str) -> str:
+        """
+        Return a valid access token for user_id, refreshing it if close to expiry
+
+        Raises:
+            TokenError: If the user has no tokens or the refresh was rejected
+            TokenRefreshUnavailable: If the token endpoint failed or was unreachable
+        """
+        # Stores may do blocking I/O, e.g. SQLite
+        record = await asyncio.to_thread(self.store.get, user_id)
+        if record is None:
+            raise TokenError(f"No tokens stored for user {user_id}")
+        if record["expires_at"] - self.refresh_margin > time.time():
+            return record["access_token"]
+        if not record.get("refresh_token"):
+            raise TokenError(f"Access token expired for user {user_id}")
+
+        task = self._refreshing.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._refresh(user_id, record["refresh_token"])
+            )
+            self._refreshing[user_id] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def _refresh(self, user_id: str, refresh_token: str) -> str:
+        try:
+            token_data = await refresh_access_token(
+                refresh_token, self.client_id, self.client_secret
+            )
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in (400, 401):
+                # Refresh token revoked or invalid; the user must log in again
+                await asyncio.to_thread(self.forget, user_id)
+                raise TokenError(f"Failed to refresh token for user {user_id}: {e}")
+            raise TokenRefreshUnavailable(
+                f"Failed to refresh token for user {user_id}: {e}"
+            )
+        except httpx.TransportError as e:
+            # Connect errors and timeouts; the refresh token is still good
+            raise TokenRefreshUnavailable(
+                f"Failed to refresh token for user {user_id}: {e!r}"
+            )
+        logger.debug(f"Refreshed access token for user {user_id}")
+        return await asyncio.to_thread(self.save, user_id, token_data)
@@ -0,0 +1,108 @@
+const ARTISTS_PER_PAGE = 10;
+let allArtists = [];
+let currentPage = 1;
+
+async function logout() {
+    try {
+        await fetch('/api/auth/logout', {
+            method: 'POST',
+            credentials: 'include'
+        });
+    } catch (err) {
+        console.error('Logout error:', err);
+    }
+    window.location.href = '/';
+}
+
+async function fetchTopArtists() {
+    document.getElementById('fetch-btn').disabled = true;
+    document.getElementById('loading').style.display = 'block';
+    document.getElementById('error-message').style.display = 'none';
+    document.getElementById('success-message').style.display = 'none';
+    document.getElementById('results').style.display = 'none';
+
+    try {
+        const res = await fetch(`/api/data/top-artists?limit=50`, {
+            credentials: 'include'
+        });
+        if (!res.ok) throw new Error('Failed to fetch artists');
+
+        const data = await res.json();
+        allArtists = data.items || [];
+
+        if (allArtists.length === 0) {
+            showError('No artists found. Try again later.');
+            return;
+        }
+
+        currentPage = 1;
+        displayArtists();
+        showSuccess(`Successfully fetched and saved ${allArtists.length} artists!`);
+        document.getElementById('results').style.display = 'block';
+    } catch (err) {
+        console.error('Error:', err);
+        showError('Failed to fetch artists. Please try again.');
+    } finally {
+        document.getElementById('loading').style.display = 'none';
+        document.getElementById('fetch-btn').disabled = false;
+    }
+}
+
+function displayArtists() {
+    const grid = document.getElementById('artists-grid');
+    grid.innerHTML = '';
+
+    const start = (currentPage - 1) * ARTISTS_PER_PAGE;
+    const end = start + ARTISTS_PER_PAGE;
+    const pageArtists = allArtists.slice(start, end);
+
+    pageArtists.forEach((artist, index) => {
+        const rank = start + index + 1;
+        const card = document.createElement('div');
+        card.className = 'artist-card';
+        card.innerHTML = `
+            ${artist.image ? `<img src="${artist.image}" alt="${artist.name}" class="artist-image">` : '<div class="artist-image"></div>'}
+            <div class="artist-name">${artist.name}</div>
+            <div class="artist-rank">#${rank}</div>
+        `;
+        grid.appendChild(card);
+    });
+
+    updatePagination();
+}
+
+function updatePagination() {
+    const totalPages = Math.ceil(allArtists.length / ARTISTS_PER_PAGE);
+    const pagination = document.getElementById('pagination');
+    pagination.innerHTML = '';
+
+    for (let i = 1; i <= totalPages; i++) {
+        const btn = document.createElement('button');
+        btn.className = `page-btn ${i === currentPage ? 'active' : ''}`;
+        btn.textContent = i;
+        btn.disabled = i === currentPage;
+        btn.onclick = () => {
+            currentPage = i;
+            displayArtists();
+        };
+        pagination.appendChild(btn);
+    }
+}
+
+function showError(message) {
+    const errorDiv = document.getElementById('error-message');
+    errorDiv.textContent = message;
+    errorDiv.style.display = 'block';
+}
+
+function showSuccess(message) {
+    const successDiv = document.getElementById('success-message');
+    successDiv.textContent = message;
+    successDiv.style.display = 'block';
+}
+
+window.addEventListener('load', () => {
+    // Session authentication is handled by cookies automatically
+    // If user is not authenticated, the API will return 401
+    // and redirect will happen from the fetch error handler
+});
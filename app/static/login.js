@@ -0,0 +1,5 @@
+async function authorize() {
+    const res = await fetch('/api/auth/authorize');
+    const data = await res.json();
+    window.location.href = data.auth_url;
+}
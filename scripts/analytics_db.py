@@ -0,0 +1,309 @@
+"""Local SQLite database of synced user data, for fast analytical queries"""
+
+import gzip
+import json
+import os
+import sqlite3
+
+from app.services.catalog import CATALOG_PREFIX
+from app.services.compaction import parse_snapshot_name
+from app.services.spotify import LIBRARY_COLLECTIONS
+
+DEFAULT_DB_PATH = os.path.join("fetched_data", "analytics.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS artists (
+    artist_id TEXT PRIMARY KEY,
+    name TEXT,
+    popularity INTEGER,
+    followers INTEGER
+);
+CREATE TABLE IF NOT EXISTS genres (
+    genre_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS artist_genres (
+    artist_id TEXT NOT NULL,
+    genre_id INTEGER NOT NULL,
+    PRIMARY KEY (artist_id, genre_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_artist_genres_genre ON artist_genres (genre_id);
+CREATE TABLE IF NOT EXISTS tracks (
+    track_id TEXT PRIMARY KEY,
+    name TEXT,
+    album_id TEXT,
+    album_name TEXT,
+    popularity INTEGER,
+    duration_ms INTEGER
+);
+CREATE TABLE IF NOT EXISTS track_artists (
+    track_id TEXT NOT NULL,
+    artist_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (track_id, artist_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_track_artists_artist ON track_artists (artist_id);
+CREATE TABLE IF NOT EXISTS user_artists (
+    user_id TEXT NOT NULL,
+    time_range TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    artist_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, time_range, rank)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_user_artists_artist
+    ON user_artists (artist_id, time_range, rank);
+CREATE TABLE IF NOT EXISTS user_tracks (
+    user_id TEXT NOT NULL,
+    time_range TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    track_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, time_range, rank)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_user_tracks_track
+    ON user_tracks (track_id, time_range, rank);
+CREATE TABLE IF NOT EXISTS user_library (
+    user_id TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    PRIMARY KEY (user_id, collection, item_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_user_library_item
+    ON user_library (item_id, collection);
+CREATE TABLE IF NOT EXISTS synced_blobs (
+    name TEXT PRIMARY KEY,
+    generation INTEGER,
+    crc32c TEXT
+);
+"""
+
+
+def connect(path=DEFAULT_DB_PATH):
+    """Open (creating if needed) the analytics database"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def is_current(conn, blob):
+    """Whether this generation of a blob has already been ingested"""
+    row = conn.execute(
+        "SELECT generation, crc32c FROM synced_blobs WHERE name = ?", (blob.name,)
+    ).fetchone()
+    return row is not None and row == (blob.generation, blob.crc32c)
+
+
+def parse_blob_name(name):
+    """
+    Split a blob name into (user_id, kind, time_range_or_collection)
+
+    Returns None for blobs that are not user snapshots, e.g.
+    '123/artists.json' -> ('123', 'artists', 'medium_term') and
+    '123/saved_tracks.ndjson' -> ('123', 'library', 'saved_tracks').
+    """
+    user_id, _, filename = name.rpartition("/")
+    stem, _, extension = filename.partition(".")
+    if user_id and extension == "ndjson" and stem in LIBRARY_COLLECTIONS:
+        return user_id, "library", stem
+    return parse_snapshot_name(name)
+
+
+def parse_catalog_name(name):
+    """
+    Split a catalog blob name into (kind, item_id), or None for other blobs
+
+    e.g. 'catalog/artists/0TnOYISbd1XYRBk9myaseg.json' -> ('artists', '0TnO...')
+    """
+    if not name.startswith(CATALOG_PREFIX):
+        return None
+    kind, _, filename = name[len(CATALOG_PREFIX) :].partition("/")
+    item_id, _, extension = filename.partition(".")
+    if kind not in ("artists", "tracks") or extension != "json" or not item_id:
+        return None
+    return kind, item_id
+
+
+def read_bytes(path):
+    """Read a synced file, decompressing it if it was stored gzipped"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    if raw[:2] == b"\x1f\x8b":
+        raw = gzip.decompress(raw)
+    return raw
+
+
+def upsert_artist(conn, artist, genre_ids):
+    conn.execute(
+        "INSERT INTO artists (artist_id, name, popularity, followers) "
+        "VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (artist_id) DO UPDATE SET name = excluded.name, "
+        "popularity = COALESCE(excluded.popularity, popularity), "
+        "followers = COALESCE(excluded.followers, followers)",
+        (
+            artist["id"],
+            artist.get("name"),
+            artist.get("popularity"),
+            (artist.get("followers") or {}).get("total"),
+        ),
+    )
+    # Simplified artist objects (inside tracks) carry no genres
+    if "genres" not in artist:
+        return
+    conn.execute("DELETE FROM artist_genres WHERE artist_id = ?", (artist["id"],))
+    for genre in artist["genres"]:
+        genre_id = genre_ids.get(genre)
+        if genre_id is None:
+            conn.execute("INSERT OR IGNORE INTO genres (name) VALUES (?)", (genre,))
+            genre_id = conn.execute(
+                "SELECT genre_id FROM genres WHERE name = ?", (genre,)
+            ).fetchone()[0]
+            genre_ids[genre] = genre_id
+        conn.execute(
+            "INSERT OR IGNORE INTO artist_genres (artist_id, genre_id) VALUES (?, ?)",
+            (artist["id"], genre_id),
+        )
+
+
+def upsert_track(conn, track, genre_ids):
+    album = track.get("album") or {}
+    conn.execute(
+        "INSERT INTO tracks "
+        "(track_id, name, album_id, album_name, popularity, duration_ms) "
+        "VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (track_id) DO UPDATE SET name = excluded.name, "
+        "album_id = excluded.album_id, album_name = excluded.album_name, "
+        "popularity = excluded.popularity, duration_ms = excluded.duration_ms",
+        (
+            track["id"],
+            track.get("name"),
+            album.get("id"),
+            album.get("name"),
+            track.get("popularity"),
+            track.get("duration_ms"),
+        ),
+    )
+    conn.execute("DELETE FROM track_artists WHERE track_id = ?", (track["id"],))
+    for position, artist in enumerate(track.get("artists") or []):
+        if not artist.get("id"):
+            continue
+        upsert_artist(conn, artist, genre_ids)
+        conn.execute(
+            "INSERT OR IGNORE INTO track_artists (track_id, artist_id, position) "
+            "VALUES (?, ?, ?)",
+            (track["id"], artist["id"], position),
+        )
+
+
+def ingest_snapshot(conn, user_id, kind, time_range, data, genre_ids):
+    """Replace a user's ranked top artists or tracks for one time range"""
+    table, key = ("user_artists", "artist_id")
+    if kind == "tracks":
+        table, key = ("user_tracks", "track_id")
+    upsert = upsert_artist if kind == "artists" else upsert_track
+
+    conn.execute(
+        f"DELETE FROM {table} WHERE user_id = ? AND time_range = ?",
+        (user_id, time_range),
+    )
+    if isinstance(data, dict) and "catalog" in data:
+        # Ranked IDs only; the objects are loaded from their catalog files
+        conn.executemany(
+            f"INSERT INTO {table} (user_id, time_range, rank, {key}) "
+            "VALUES (?, ?, ?, ?)",
+            [
+                (user_id, time_range, entry["rank"], entry["id"])
+                for entry in data.get("items") or []
+            ],
+        )
+        return
+    items = data.get("items", []) if isinstance(data, dict) else data
+    for rank, item in enumerate(items, start=1):
+        if not item or not item.get("id"):
+            continue
+        upsert(conn, item, genre_ids)
+        conn.execute(
+            f"INSERT INTO {table} (user_id, time_range, rank, {key}) "
+            "VALUES (?, ?, ?, ?)",
+            (user_id, time_range, rank, item["id"]),
+        )
+
+
+def ingest_library(conn, user_id, collection, lines, genre_ids):
+    """Replace one of a user's library collections"""
+    conn.execute(
+        "DELETE FROM user_library WHERE user_id = ? AND collection = ?",
+        (user_id, collection),
+    )
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if collection == "followed_artists":
+            item = record
+            upsert_artist(conn, item, genre_ids)
+        elif collection == "saved_albums":
+            item = record.get("album") or {}
+        else:
+            item = record.get("track") or {}
+            # Local files and unavailable tracks have no ID
+            if item.get("id"):
+                upsert_track(conn, item, genre_ids)
+        if item.get("id"):
+            conn.execute(
+                "INSERT OR IGNORE INTO user_library (user_id, collection, item_id) "
+                "VALUES (?, ?, ?)",
+                (user_id, collection, item["id"]),
+            )
+
+
+def ingest_blob(conn, blob, local_path, genre_ids):
+    """
+    Load one synced file into the database, replacing what it previously held
+
+    Each blob is ingested in its own transaction together with its
+    synced_blobs entry, so an interrupted sync never leaves a half-loaded file
+    marked as done.
+
+    Returns:
+        True if the blob was ingested, False if it is not a user snapshot or
+        catalog object
+    """
+    catalog_entry = parse_catalog_name(blob.name)
+    parsed = None if catalog_entry else parse_blob_name(blob.name)
+    if catalog_entry is None and parsed is None:
+        return False
+    raw = read_bytes(local_path)
+
+    with conn:
+        if catalog_entry is not None:
+            kind, _ = catalog_entry
+            upsert = upsert_artist if kind == "artists" else upsert_track
+            upsert(conn, json.loads(raw), genre_ids)
+        else:
+            user_id, kind, detail = parsed
+            conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
+            if kind == "library":
+                ingest_library(conn, user_id, detail, raw.splitlines(), genre_ids)
+            else:
+                ingest_snapshot(conn, user_id, kind, detail, json.loads(raw), genre_ids)
+        conn.execute(
+            "INSERT OR REPLACE INTO synced_blobs (name, generation, crc32c) "
+            "VALUES (?, ?, ?)",
+            (blob.name, blob.generation, blob.crc32c),
+        )
+    return True
+
+
+def users_with_artist(conn, artist_id, max_rank=10, time_range="medium_term"):
+    """User IDs that have an artist in their top max_rank, best rank first"""
+    rows = conn.execute(
+        "SELECT user_id FROM user_artists "
+        "WHERE artist_id = ? AND time_range = ? AND rank <= ? ORDER BY rank",
+        (artist_id, time_range, max_rank),
+    )
+    return [row[0] for row in rows]
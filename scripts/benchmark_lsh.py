@@ -0,0 +1,93 @@
+"""Measure LSH index build time, memory footprint and recall against exact scoring
+
+Run from the repository root:
+
+    uv run python -m scripts.benchmark_lsh [--sample 200] [--k 10]
+    uv run python -m scripts.benchmark_lsh --synthetic 20000
+"""
+
+import argparse
+import random
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+from app.services.feature_store import FeatureStore
+from app.services.lsh import LSHIndex, measure_recall
+from app.services.matching import MatchIndex, load_from_storage, user_features
+from app.services.storage import get_storage_service
+
+load_dotenv()
+
+
+def load_synthetic(indexes, users, seed=0):
+    """Users drawn from a few hundred taste clusters of overlapping artists"""
+    rng = random.Random(seed)
+    clusters = [rng.sample(range(20000), 200) for _ in range(max(users // 50, 1))]
+    for user in range(users):
+        cluster = rng.choice(clusters)
+        artists = rng.sample(cluster, 40) + rng.sample(range(20000), 10)
+        data = {
+            "items": [
+                {"id": f"a{artist}", "genres": [f"g{artist % 700}"]}
+                for artist in artists
+            ]
+        }
+        features = user_features([(("artists", "medium_term"), data)])
+        for index in indexes:
+            index.update_user(f"user{user}", features)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sample", type=int, default=200, help="Users queried")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--synthetic", type=int, help="Use this many synthetic users, not the bucket"
+    )
+    args = parser.parse_args()
+
+    match_index = MatchIndex(FeatureStore(tempfile.mkdtemp(prefix="features-")))
+    lsh_index = LSHIndex()
+    started = time.perf_counter()
+    if args.synthetic:
+        load_synthetic([match_index, lsh_index], args.synthetic)
+    else:
+        load_from_storage(get_storage_service(), [match_index, lsh_index])
+    print(f"Loaded {len(match_index)} users in {time.perf_counter() - started:.1f}s")
+    print(f"LSH build time: {lsh_index.build_seconds:.2f}s")
+    print(f"LSH memory:     {lsh_index.memory_bytes() / 2**20:.1f} MiB")
+
+    started = time.perf_counter()
+    restored = LSHIndex.from_bytes(lsh_index.to_bytes())
+    print(
+        f"LSH save + load: {time.perf_counter() - started:.2f}s ({len(restored)} users)"
+    )
+
+    # Build the sparse matrix up front so it is not counted as query time
+    match_index.matrix()
+    sample = random.Random(1).sample(
+        match_index.user_ids(), min(args.sample, len(match_index))
+    )
+
+    started = time.perf_counter()
+    for user_id in sample:
+        match_index.top_matches(user_id, args.k)
+    exact_ms = (time.perf_counter() - started) / len(sample) * 1000
+
+    started = time.perf_counter()
+    for user_id in sample:
+        match_index.top_matches(user_id, args.k, lsh_index.candidates(user_id))
+    lsh_ms = (time.perf_counter() - started) / len(sample) * 1000
+
+    result = measure_recall(lsh_index, match_index, sample, args.k)
+    print(f"Query time:     exact {exact_ms:.2f} ms, LSH {lsh_ms:.2f} ms")
+    print(
+        f"Recall@{args.k}:      {result['recall']:.3f} "
+        f"(scoring {result['scanned']:.1%} of users per query)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Compact per-user JSON snapshots in the bucket into columnar files
+
+Run from the repository root:
+
+    uv run python -m scripts.compact_data [--format csv] [--chunk-rows N]
+"""
+
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+from app.services.compaction import (
+    COMPACTED_PREFIX,
+    COMPACTION_CHUNK_ROWS,
+    COMPACTION_WORKERS,
+    CompactionJob,
+)
+from app.services.storage import get_storage_service
+
+load_dotenv()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--format",
+        choices=["parquet", "csv"],
+        help="Output format (default: parquet if pyarrow is installed, else csv)",
+    )
+    parser.add_argument("--chunk-rows", type=int, default=COMPACTION_CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=COMPACTION_WORKERS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        job = CompactionJob(
+            get_storage_service(),
+            chunk_rows=args.chunk_rows,
+            workers=args.workers,
+            output_format=args.format,
+        )
+        summary = job.run()
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        return
+
+    print(
+        f"\n✅ Compacted {summary['snapshots']} snapshots into {summary['files']} "
+        f"{job.output_format} files ({summary['rows']} rows) under "
+        f"gs://{job.storage.bucket_name}/{COMPACTED_PREFIX}"
+    )
+
+
+if __name__ == "__main__":
+    main()
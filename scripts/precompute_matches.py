@@ -0,0 +1,66 @@
+"""Precompute every user's top matches from the feature store
+
+Run from the repository root, e.g. nightly from cron:
+
+    uv run python -m scripts.precompute_matches [--k N] [--workers N]
+
+The API serves the lists it finds in --out; set PRECOMPUTE_INTERVAL to have
+the app run this itself instead.
+"""
+
+import argparse
+import logging
+
+from dotenv import load_dotenv
+
+from app.services.feature_store import FEATURE_STORE_DIR
+from app.services.precompute import (
+    MATCH_LISTS_DIR,
+    PRECOMPUTE_BLOCK_ROWS,
+    PRECOMPUTE_K,
+    PRECOMPUTE_WORKERS,
+    precompute_matches,
+)
+
+load_dotenv()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--store", default=FEATURE_STORE_DIR, help="Feature store")
+    parser.add_argument("--out", default=MATCH_LISTS_DIR, help="Output directory")
+    parser.add_argument("--k", type=int, default=PRECOMPUTE_K)
+    parser.add_argument("--workers", type=int, default=PRECOMPUTE_WORKERS)
+    parser.add_argument("--block-rows", type=int, default=PRECOMPUTE_BLOCK_ROWS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        summary = precompute_matches(
+            store_dir=args.store,
+            output_dir=args.out,
+            k=args.k,
+            workers=args.workers,
+            block_rows=args.block_rows,
+        )
+    except Exception as e:
+        print(f"\n❌ Error: {e}")
+        return
+
+    print(
+        f"\n✅ Top {summary['k']} matches for {summary['users']} users in "
+        f"{summary['seconds']:.1f}s ({summary['users_per_second']:.0f} users/s)"
+    )
+    for pid, worker in sorted(summary["workers"].items()):
+        print(
+            f"   worker {pid}: {worker['users']} users, "
+            f"{worker['users_per_second']:.0f} users/s, "
+            f"peak RSS {worker['peak_rss_mib']:.0f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,53 +1,220 @@
+import argparse
+import json
 import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from google.cloud import storage
 
+from scripts import analytics_db
+
 # Configuration
 BUCKET_NAME = "spotdate-oauth-flow"
 LOCAL_DIR = "fetched_data"
-
-
-def download_blob(bucket, blob):
+MANIFEST_NAME = ".sync_manifest.json"
+DEFAULT_WORKERS = 8
+
+# Save the manifest after this many downloads so an interrupted sync can resume
+MANIFEST_SAVE_EVERY = 50
+
+
+class Manifest:
+    """
+    Record of the generation and crc32c of every blob synced to LOCAL_DIR
+
+    A blob whose generation and crc32c match its entry, and whose local file
+    still exists, is skipped. Entries are only written after a download has
+    completed, so a crashed sync simply picks up where it stopped.
+    """
+
+    def __init__(self, local_dir):
+        self.local_dir = local_dir
+        self.path = os.path.join(local_dir, MANIFEST_NAME)
+        self.entries = {}
+        self.pending = 0
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    def is_current(self, blob):
+        entry = self.entries.get(blob.name)
+        return (
+            entry is not None
+            and entry["generation"] == blob.generation
+            and entry["crc32c"] == blob.crc32c
+            and os.path.exists(os.path.join(self.local_dir, blob.name))
+        )
+
+    def record(self, blob):
+        with self.lock:
+            self.entries[blob.name] = {
+                "generation": blob.generation,
+                "crc32c": blob.crc32c,
+            }
+            self.pending += 1
+            if self.pending >= MANIFEST_SAVE_EVERY:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        os.makedirs(self.local_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+        self.pending = 0
+
+
+def download_blob(blob, local_dir=LOCAL_DIR):
     """Downloads a blob to the local directory, preserving folder structure."""
     # Create local path (e.g., downloaded_data/user_123/artists.json)
-    local_path = os.path.join(LOCAL_DIR, blob.name)
+    local_path = os.path.join(local_dir, blob.name)
     local_folder = os.path.dirname(local_path)
 
     # Ensure local folder exists
-    if not os.path.exists(local_folder):
-        os.makedirs(local_folder)
+    os.makedirs(local_folder, exist_ok=True)
 
-    # Download
+    # Download to a temporary file so an interrupted download never looks complete
     print(f"Downloading {blob.name} ...")
-    blob.download_to_filename(local_path)
+    tmp_path = f"{local_path}.part"
+    blob.download_to_filename(tmp_path)
+    os.replace(tmp_path, local_path)
+
+
+def iter_blobs(bucket, prefixes):
+    """Stream blobs page by page, optionally restricted to some prefixes."""
+    for prefix in prefixes or [None]:
+        yield from bucket.list_blobs(prefix=prefix)
+
 
+class AnalyticsLoader:
+    """Upserts synced files into the analytics database as they arrive"""
 
-def sync_bucket():
+    def __init__(self, db_path, local_dir):
+        self.conn = analytics_db.connect(db_path)
+        self.local_dir = local_dir
+        self.genre_ids = {}
+        self.ingested = 0
+
+    def load(self, blob):
+        # Only blobs that changed since they were last ingested are re-read
+        if analytics_db.is_current(self.conn, blob):
+            return
+        local_path = os.path.join(self.local_dir, blob.name)
+        try:
+            if analytics_db.ingest_blob(self.conn, blob, local_path, self.genre_ids):
+                self.ingested += 1
+        except Exception as e:
+            print(f"  ⚠️ Failed to ingest {blob.name}: {e}")
+
+    def close(self):
+        self.conn.close()
+
+
+def sync_bucket(
+    bucket_name=BUCKET_NAME,
+    local_dir=LOCAL_DIR,
+    prefixes=None,
+    workers=DEFAULT_WORKERS,
+    db_path=None,
+):
     # Initialize client (looks for local gcloud creds automatically)
     storage_client = storage.Client()
+    manifest = Manifest(local_dir)
+    loader = AnalyticsLoader(db_path, local_dir) if db_path else None
+    seen = skipped = downloaded = failed = 0
 
     try:
-        bucket = storage_client.bucket(BUCKET_NAME)
-        blobs = list(bucket.list_blobs())
-
-        if not blobs:
-            print(f"Bucket {BUCKET_NAME} is empty!")
+        bucket = storage_client.bucket(bucket_name)
+        print(f"Syncing gs://{bucket_name} to '{local_dir}/' with {workers} workers...")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            in_flight = {}
+
+            def collect(done):
+                nonlocal downloaded, failed
+                for future in done:
+                    blob = in_flight.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f"  ⚠️ Failed {blob.name}: {e}")
+                    else:
+                        downloaded += 1
+                        manifest.record(blob)
+                        if loader:
+                            loader.load(blob)
+
+            for blob in iter_blobs(bucket, prefixes):
+                # Skip folders/trailing slashes if any
+                if blob.name.endswith("/"):
+                    continue
+                seen += 1
+                if manifest.is_current(blob):
+                    skipped += 1
+                    # Still load it if the database was created after the sync
+                    if loader:
+                        loader.load(blob)
+                    continue
+
+                # Keep at most a couple of batches queued so listing stays lazy
+                if len(in_flight) >= workers * 2:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                in_flight[executor.submit(download_blob, blob, local_dir)] = blob
+
+            collect(wait(in_flight).done)
+
+        if seen == 0:
+            print(f"No files found in bucket {bucket_name}!")
             return
 
-        print(f"Found {len(blobs)} files. Syncing to '{LOCAL_DIR}/'...")
-
-        for blob in blobs:
-            # Skip folders/trailing slashes if any
-            if blob.name.endswith("/"):
-                continue
-            download_blob(bucket, blob)
-
-        print("\n✅ Sync complete!")
+        print(
+            f"\n✅ Sync complete! {downloaded} downloaded, {skipped} unchanged, "
+            f"{failed} failed ({seen} files)."
+        )
+        if loader:
+            print(f"📊 Ingested {loader.ingested} files into {db_path}")
 
     except Exception as e:
         print(f"\n❌ Error: {e}")
         print("Did you run 'gcloud auth application-default login'?")
+    finally:
+        manifest.save()
+        if loader:
+            loader.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sync the GCS bucket to local disk")
+    parser.add_argument("--bucket", default=BUCKET_NAME)
+    parser.add_argument("--dest", default=LOCAL_DIR, help="Local directory")
+    parser.add_argument(
+        "--prefix",
+        action="append",
+        help="Only sync blobs under this prefix (repeatable), e.g. a user_id/",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Concurrent downloads",
+    )
+    parser.add_argument(
+        "--db",
+        nargs="?",
+        const=analytics_db.DEFAULT_DB_PATH,
+        help="Also upsert the synced data into a local SQLite analytics database "
+        f"(default path: {analytics_db.DEFAULT_DB_PATH})",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    sync_bucket()
+    args = parse_args()
+    sync_bucket(args.bucket, args.dest, args.prefix, args.workers, args.db)
@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.services import feature_store
+from app.services.feature_store import FeatureStore
+
+
+def vectors(store: FeatureStore) -> dict[str, dict[str, float]]:
+    """Every user's live vector as {feature: value}"""
+    snapshot = store.snapshot()
+    matrix, latest = snapshot.matrix, snapshot.latest
+    result = {}
+    for row in latest[latest >= 0].tolist():
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        result[snapshot.user_ids[snapshot.row_users[row]]] = {
+            snapshot.features[column]: float(value)
+            for column, value in zip(
+                matrix.indices[start:end].tolist(), matrix.data[start:end].tolist()
+            )
+        }
+    return result
+
+
+def test_latest_row_replaces_previous(tmp_path):
+    store = FeatureStore(str(tmp_path))
+    assert store.append("a", ["artist:1", "genre:pop"], [1.0, 0.5]) == 0
+    assert store.append("b", ["artist:2"], [1.0]) == 1
+    assert store.append("a", ["artist:3"], [2.0]) == 2
+
+    assert vectors(store) == {"a": {"artist:3": 2.0}, "b": {"artist:2": 1.0}}
+    assert store.snapshot().matrix.shape[0] == 3
+
+
+def test_reopen_sees_rows_from_another_store(tmp_path):
+    writer = FeatureStore(str(tmp_path))
+    reader = FeatureStore(str(tmp_path))
+    writer.append("a", ["artist:1"], [1.0])
+
+    assert vectors(reader) == {"a": {"artist:1": 1.0}}
+    assert vectors(FeatureStore(str(tmp_path))) == vectors(writer)
+
+
+def test_repair_drops_uncommitted_writes(tmp_path):
+    store = FeatureStore(str(tmp_path))
+    store.append("a", ["artist:1", "artist:2"], [1.0, 2.0])
+    store.close()
+
+    # A crash after writing a vector but before its row record committed it
+    path = os.path.join(str(tmp_path), "g0")
+    with open(os.path.join(path, "indices.bin"), "ab") as f:
+        np.array([5, 6], dtype=feature_store.INDEX_DTYPE).tofile(f)
+    with open(os.path.join(path, "data.bin"), "ab") as f:
+        np.array([1.0], dtype=feature_store.VALUE_DTYPE).tofile(f)
+    with open(os.path.join(path, "rows.bin"), "ab") as f:
+        f.write(b"\x01\x02\x03")
+    with open(os.path.join(path, "vocab.txt"), "ab") as f:
+        f.write(b"artist:half")
+
+    store = FeatureStore(str(tmp_path))
+
+    assert vectors(store) == {"a": {"artist:1": 1.0, "artist:2": 2.0}}
+    assert store.features == ["artist:1", "artist:2"]
+    assert os.path.getsize(os.path.join(path, "indices.bin")) == 2 * 4
+    assert os.path.getsize(os.path.join(path, "rows.bin")) == (
+        feature_store.ROW_DTYPE.itemsize
+    )
+    # The repaired store takes new rows where the committed ones end
+    store.append("b", ["artist:3"], [3.0])
+    assert vectors(FeatureStore(str(tmp_path)))["b"] == {"artist:3": 3.0}
+
+
+@pytest.fixture
+def compact_early(monkeypatch):
+    monkeypatch.setattr(feature_store, "COMPACT_MIN_ROWS", 4)
+
+
+def test_compact_keeps_only_live_rows(tmp_path, compact_early):
+    store = FeatureStore(str(tmp_path))
+    for i in range(5):
+        store.append("a", [f"artist:{i}"], [float(i)])
+    store.append("b", ["artist:4", "genre:rock"], [1.0, 0.5])
+    before = vectors(store)
+
+    assert store.compact()
+
+    assert store.generation == 1
+    assert store.snapshot().matrix.shape[0] == 2
+    assert vectors(store) == before
+    # Features no live row uses are dropped
+    assert sorted(store.features) == ["artist:4", "genre:rock"]
+    assert not os.path.exists(os.path.join(str(tmp_path), "g0"))
+
+
+def test_compact_is_skipped_below_threshold(tmp_path, compact_early):
+    store = FeatureStore(str(tmp_path))
+    for user_id in "abcd":
+        store.append(user_id, ["artist:1"], [1.0])
+    store.append("a", ["artist:2"], [1.0])
+
+    assert not store.compact()
+    assert store.generation == 0
+
+
+def test_other_stores_follow_a_compaction(tmp_path, compact_early):
+    first = FeatureStore(str(tmp_path))
+    second = FeatureStore(str(tmp_path))
+    for i in range(6):
+        first.append("a", [f"artist:{i}"], [1.0])
+    second.snapshot()
+
+    assert second.compact()
+    assert not first.compact()
+
+    assert first.generation == second.generation == 1
+    assert vectors(first) == vectors(second) == {"a": {"artist:5": 1.0}}
+    first.append("b", ["artist:1"], [1.0])
+    assert vectors(second)["b"] == {"artist:1": 1.0}
+
+
+def test_compacts_on_open(tmp_path, compact_early):
+    store = FeatureStore(str(tmp_path))
+    for i in range(6):
+        store.append("a", [f"artist:{i}"], [1.0])
+    store.close()
+
+    reopened = FeatureStore(str(tmp_path))
+
+    assert reopened.generation == 1
+    assert vectors(reopened) == {"a": {"artist:5": 1.0}}
+
+
+def test_store_id_survives_compaction(tmp_path, compact_early):
+    store = FeatureStore(str(tmp_path / "a"))
+    for i in range(6):
+        store.append("a", [f"artist:{i}"], [1.0])
+    store_id = store.snapshot().store_id
+
+    assert store.compact()
+
+    assert FeatureStore(str(tmp_path / "a")).snapshot().store_id == store_id
+    assert FeatureStore(str(tmp_path / "b")).store_id != store_id
@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+from app.services.ingest_queue import IngestQueue
+
+
+class PermanentError(Exception):
+    pass
+
+
+def run_queue(path: str, handler, seconds: float, **kwargs) -> int:
+    """Enqueue user 'u', let the workers run for a while and stop them
+
+    Returns:
+        Jobs left in the queue
+    """
+    kwargs = {"workers": 1, "backoff": 0.01, "poll_interval": 0.01, **kwargs}
+
+    async def main() -> int:
+        queue = IngestQueue(path, handler, **kwargs)
+        await queue.start()
+        await queue.enqueue("u")
+        await asyncio.sleep(seconds)
+        depth = queue.depth()
+        await queue.stop()
+        return depth
+
+    return asyncio.run(main())
+
+
+def test_failed_job_is_retried(tmp_path):
+    calls = []
+
+    async def handler(user_id):
+        calls.append(user_id)
+        if len(calls) < 3:
+            raise RuntimeError("Spotify is down")
+
+    depth = run_queue(str(tmp_path / "q.db"), handler, 0.5)
+
+    assert calls == ["u", "u", "u"]
+    assert depth == 0
+
+
+def test_job_is_dropped_after_max_attempts(tmp_path):
+    calls = []
+
+    async def handler(user_id):
+        calls.append(user_id)
+        raise RuntimeError("Spotify is down")
+
+    depth = run_queue(str(tmp_path / "q.db"), handler, 0.5, max_attempts=2)
+
+    assert len(calls) == 2
+    assert depth == 0
+
+
+def test_permanent_error_is_not_retried(tmp_path):
+    calls = []
+
+    async def handler(user_id):
+        calls.append(user_id)
+        raise PermanentError("no tokens")
+
+    depth = run_queue(
+        str(tmp_path / "q.db"), handler, 0.3, permanent_errors=(PermanentError,)
+    )
+
+    assert calls == ["u"]
+    assert depth == 0
+
+
+def test_backoff_delays_retry(tmp_path):
+    async def handler(user_id):
+        raise RuntimeError("Spotify is down")
+
+    depth = run_queue(str(tmp_path / "q.db"), handler, 0.2, backoff=60)
+
+    assert depth == 1
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    async def handler(user_id):
+        pass
+
+    queue = IngestQueue(str(tmp_path / "q.db"), handler, lease=0.1)
+    queue._put("u")
+
+    assert queue._claim() == ("u", 0, 0)
+    assert queue._claim() is None
+    time.sleep(0.15)
+    assert queue._claim() == ("u", 0, 0)
+
+
+def test_running_job_keeps_its_lease(tmp_path):
+    path = str(tmp_path / "q.db")
+    calls = []
+
+    async def handler(user_id):
+        calls.append(user_id)
+        # Several leases long
+        await asyncio.sleep(0.5)
+
+    async def main():
+        first = IngestQueue(path, handler, workers=1, lease=0.15, poll_interval=0.01)
+        second = IngestQueue(path, handler, workers=1, lease=0.15, poll_interval=0.01)
+        await first.start()
+        await first.enqueue("u")
+        await asyncio.sleep(0.05)
+        await second.start()
+        await asyncio.sleep(0.7)
+        assert first.depth() == 0
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(main())
+
+    assert calls == ["u"]
+
+
+def test_job_enqueued_while_running_runs_again(tmp_path):
+    calls = []
+
+    async def main():
+        async def handler(user_id):
+            calls.append(user_id)
+            if len(calls) == 1:
+                await queue.enqueue(user_id)
+
+        queue = IngestQueue(str(tmp_path / "q.db"), handler, poll_interval=0.01)
+        await queue.start()
+        await queue.enqueue("u")
+        await asyncio.sleep(0.2)
+        assert queue.depth() == 0
+        await queue.stop()
+
+    asyncio.run(main())
+
+    assert calls == ["u", "u"]
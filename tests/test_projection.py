@@ -0,0 +1,48 @@
+from app.services.projection import project_page, select_fields
+
+ARTIST = {
+    "id": "a1",
+    "name": "Artist",
+    "followers": {"href": None, "total": 10},
+    "images": [
+        {"url": "small.jpg", "width": 64, "height": 64},
+        {"url": "large.jpg", "width": 640, "height": 640},
+    ],
+}
+
+
+def test_list_field_keeps_every_subfield():
+    assert select_fields(ARTIST, ["images.url", "images.width"]) == {
+        "images": [
+            {"url": "small.jpg", "width": 64},
+            {"url": "large.jpg", "width": 640},
+        ]
+    }
+
+
+def test_dict_field_keeps_every_subfield():
+    assert select_fields(ARTIST, ["followers.total", "followers.href"]) == {
+        "followers": {"total": 10, "href": None}
+    }
+
+
+def test_bare_field_keeps_whole_value():
+    assert select_fields(ARTIST, ["images.url", "images"]) == {
+        "images": ARTIST["images"]
+    }
+
+
+def test_missing_fields_are_left_out():
+    assert select_fields(ARTIST, ["id", "genres", "album.name"]) == {"id": "a1"}
+
+
+def test_project_page_parses_field_list():
+    page = project_page(
+        {"items": [ARTIST], "total": 1}, dict, fields="name, images.url"
+    )
+    assert page == {
+        "items": [
+            {"name": "Artist", "images": [{"url": "small.jpg"}, {"url": "large.jpg"}]}
+        ],
+        "total": 1,
+    }